@@ -0,0 +1,153 @@
+"""
+Memory-mapped columnar storage for the imitation learning datasets.
+
+The CSV files (header 'tank1,...,tankn,target' as in data/train.txt) are converted once with csv_to_columns()
+to a directory with one .npy file per column, which is then opened with ColumnDataset (memory-mapped, so the
+data does not need to fit in memory) to stream shuffled mini-batches:
+
+    csv_to_columns('data/train.txt', 'data/train.cols')
+    train = ColumnDataset('data/train.cols')
+    for X_batch, y_batch in train.batches(batch_size = 50, seed = epoch):
+        ...
+"""
+import os
+import json
+import queue
+import threading
+from itertools import islice
+
+import numpy as np
+
+
+FEATURES_DTYPE = np.float32
+TARGET_DTYPE = np.int64
+METADATA_FILE = 'columns.json'
+
+def csv_to_columns(csv_file, out_dir, target = 'target', chunk_rows = 10**5):
+    """
+    Converts a CSV file with a header row into a directory of memory-mappable .npy columns (features as float32,
+    the target column as int64), reading chunk_rows rows at a time. Returns out_dir.
+    """
+    with open(csv_file) as f:
+        columns = f.readline().strip().split(',')
+        n_rows = sum(1 for line in f if line.strip())
+
+    os.makedirs(out_dir, exist_ok = True)
+    arrays = []
+    for column in columns:
+        dtype = TARGET_DTYPE if column == target else FEATURES_DTYPE
+        arrays.append(np.lib.format.open_memmap(os.path.join(out_dir, column + '.npy'), mode = 'w+',
+                                                dtype = dtype, shape = (n_rows,)))
+
+    with open(csv_file) as f:
+        f.readline()
+        row = 0
+        while row < n_rows:
+            lines = [line for line in islice(f, chunk_rows) if line.strip()]
+            if not lines:
+                break
+            chunk = np.loadtxt(lines, delimiter = ',', ndmin = 2)
+            for j, array in enumerate(arrays):
+                array[row:row + len(chunk)] = chunk[:, j]
+            row = row + len(chunk)
+
+    for array in arrays:
+        array.flush()
+    with open(os.path.join(out_dir, METADATA_FILE), 'w') as f:
+        json.dump({'columns': columns, 'target': target, 'rows': n_rows}, f)
+    return out_dir
+
+
+class ColumnDataset():
+    """
+    Dataset stored by csv_to_columns(), with every column memory-mapped (read only).
+    """
+    def __init__(self, directory):
+        with open(os.path.join(directory, METADATA_FILE)) as f:
+            metadata = json.load(f)
+        self.directory = directory
+        self.columns = metadata['columns']
+        self.target = metadata['target']
+        self.features = [column for column in self.columns if column != self.target]
+        self.data = {column: np.load(os.path.join(directory, column + '.npy'), mmap_mode = 'r')
+                     for column in self.columns}
+
+    def __len__(self):
+        return len(self.data[self.target])
+
+    def column(self, name):
+        return self.data[name]
+
+    def get(self, indices, features = None):
+        """
+        Returns (X, y) for the given row indices (a slice or an array), with X of shape (rows, n_features)
+        """
+        if features is None:
+            features = self.features
+        X = np.stack([self.data[column][indices] for column in features], axis = 1)
+        y = np.asarray(self.data[self.target][indices])
+        return X, y
+
+    def batches(self, batch_size, shuffle = True, seed = None, prefetch = 2, features = None, drop_last = False):
+        """
+        Generator of (X, y) mini-batches covering the dataset once. With shuffle = True the rows are visited in the
+        order of a random permutation given by seed (rows of each batch are read in increasing order, which keeps
+        the reads from the memory-mapped files local). The next prefetch batches are read in a background thread
+        while the current one is used.
+        """
+        n = len(self)
+        if shuffle:
+            order = np.random.default_rng(seed).permutation(n)
+        else:
+            order = np.arange(n)
+        starts = range(0, n - batch_size + 1 if drop_last else n, batch_size)
+
+        def read(start):
+            indices = order[start:start + batch_size]
+            if shuffle:
+                indices = np.sort(indices)
+            else:
+                indices = slice(start, start + batch_size)
+            return self.get(indices, features)
+
+        if prefetch <= 0:
+            for start in starts:
+                yield read(start)
+            return
+
+        batches = queue.Queue(maxsize = prefetch)
+        stop = threading.Event()
+        done = object()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout = 0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def producer():
+            try:
+                for start in starts:
+                    if not put(read(start)):
+                        return
+            except Exception as error:
+                put(error)
+                return
+            put(done)
+
+        thread = threading.Thread(target = producer, daemon = True)
+        thread.start()
+        try:
+            while True:
+                batch = batches.get()
+                if batch is done:
+                    break
+                if isinstance(batch, Exception):
+                    raise batch
+                yield batch
+        finally:
+            stop.set()
+            thread.join()
@@ -0,0 +1,194 @@
+"""
+Export of the trained imitation learning classifiers (TensorFlow checkpoints final_nn_classifier_sim*.ckpt) to
+a compact .npz file that mlp_classifier.MLPClassifier loads without TensorFlow:
+
+    python export_classifier.py simulations/simulation4/final_nn_classifier_sim4.ckpt
+
+writes simulations/simulation4/final_nn_classifier_sim4.npz. The checkpoint files (.index and .data shards) are
+read directly, so TensorFlow is not needed for the export either, and the graph is never rebuilt.
+
+The networks of the notebooks are tf.layers.dense layers named dense, dense_1, dense_2, ... (ELU activation in
+all the hidden layers, linear output); their kernels and biases are saved as kernel_0, bias_0, kernel_1, ... The
+optimizer slots (Adam) and the other training variables are skipped.
+"""
+import os
+import re
+import struct
+import argparse
+
+import numpy as np
+
+
+TABLE_MAGIC = 0xdb4775248b80fb57
+FOOTER_SIZE = 48
+BLOCK_TRAILER_SIZE = 5
+
+# tensorflow DataType enum values of the supported dtypes
+TF_DTYPES = {1: np.float32, 2: np.float64, 3: np.int32, 9: np.int64}
+
+LAYER_NAME = re.compile(r'^(?:.*/)?dense(?:_(\d+))?/(kernel|bias)$')
+
+
+def _varint(buffer, pos):
+    result = 0
+    shift = 0
+    while True:
+        byte = buffer[pos]
+        pos = pos + 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift = shift + 7
+
+def _proto_fields(buffer):
+    """
+    Yields (field number, value) of a serialized protocol buffer message; length-delimited values are bytes
+    """
+    pos = 0
+    while pos < len(buffer):
+        key, pos = _varint(buffer, pos)
+        field, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, pos = _varint(buffer, pos)
+        elif wire_type == 1:
+            value = struct.unpack_from('<Q', buffer, pos)[0]
+            pos = pos + 8
+        elif wire_type == 2:
+            size, pos = _varint(buffer, pos)
+            value = bytes(buffer[pos:pos+size])
+            pos = pos + size
+        elif wire_type == 5:
+            value = struct.unpack_from('<I', buffer, pos)[0]
+            pos = pos + 4
+        else:
+            raise ValueError('unsupported protocol buffer wire type {}'.format(wire_type))
+        yield field, value
+
+def _block(data, handle):
+    offset, pos = _varint(handle, 0)
+    size, pos = _varint(handle, pos)
+    if data[offset + size] != 0:
+        raise ValueError('compressed checkpoint index blocks are not supported')
+    return data[offset:offset + size]
+
+def _block_entries(block):
+    """
+    Yields the (key, value) pairs of a block of the table (keys are prefix-compressed)
+    """
+    n_restarts = struct.unpack_from('<I', block, len(block) - 4)[0]
+    end = len(block) - 4 - 4 * n_restarts
+    pos = 0
+    key = b''
+    while pos < end:
+        shared, pos = _varint(block, pos)
+        non_shared, pos = _varint(block, pos)
+        value_size, pos = _varint(block, pos)
+        key = key[:shared] + bytes(block[pos:pos + non_shared])
+        pos = pos + non_shared
+        yield key, block[pos:pos + value_size]
+        pos = pos + value_size
+
+def read_index(prefix):
+    """
+    Returns the number of data shards and {variable name: entry} of the checkpoint prefix (as passed to
+    tf.train.Saver.restore()), where every entry is a dictionary with dtype, shape, shard_id, offset and size.
+    """
+    with open(prefix + '.index', 'rb') as f:
+        data = memoryview(f.read())
+    footer = data[len(data) - FOOTER_SIZE:]
+    if struct.unpack_from('<Q', footer, FOOTER_SIZE - 8)[0] != TABLE_MAGIC:
+        raise ValueError('{}.index is not a checkpoint index'.format(prefix))
+    _, pos = _varint(footer, 0)
+    _, pos = _varint(footer, pos)
+    index_handle = footer[pos:]
+
+    n_shards = 1
+    entries = {}
+    for _, handle in _block_entries(_block(data, index_handle)):
+        for key, value in _block_entries(_block(data, handle)):
+            fields = list(_proto_fields(value))
+            if key == b'':
+                n_shards = dict(fields).get(1, 1)
+                continue
+            entry = {'dtype': 0, 'shape': [], 'shard_id': 0, 'offset': 0, 'size': 0}
+            for field, field_value in fields:
+                if field == 1:
+                    entry['dtype'] = field_value
+                elif field == 2:
+                    entry['shape'] = [dict(_proto_fields(dim)).get(1, 0)
+                                      for number, dim in _proto_fields(field_value) if number == 2]
+                elif field == 3:
+                    entry['shard_id'] = field_value
+                elif field == 4:
+                    entry['offset'] = field_value
+                elif field == 5:
+                    entry['size'] = field_value
+            entries[key.decode()] = entry
+    return n_shards, entries
+
+def read_checkpoint(prefix, names = None):
+    """
+    Returns {variable name: array} with the variables of the checkpoint prefix (all of them, or the given names)
+    """
+    n_shards, entries = read_index(prefix)
+    variables = {}
+    shards = {}
+    for name, entry in entries.items():
+        if names is not None and name not in names:
+            continue
+        if entry['dtype'] not in TF_DTYPES:
+            raise ValueError('variable {} has an unsupported dtype ({})'.format(name, entry['dtype']))
+        shard_id = entry['shard_id']
+        if shard_id not in shards:
+            with open('{}.data-{:05d}-of-{:05d}'.format(prefix, shard_id, n_shards), 'rb') as f:
+                shards[shard_id] = f.read()
+        raw = shards[shard_id][entry['offset']:entry['offset'] + entry['size']]
+        variables[name] = np.frombuffer(raw, dtype = TF_DTYPES[entry['dtype']]).reshape(entry['shape']).copy()
+    return variables
+
+def dense_layers(variables):
+    """
+    Returns the list of (kernel, bias) of the layers dense, dense_1, dense_2, ... found in variables
+    """
+    layers = {}
+    for name, value in variables.items():
+        match = LAYER_NAME.match(name)
+        if match is None:
+            continue
+        index = int(match.group(1) or 0)
+        layers.setdefault(index, {})[match.group(2)] = value
+    if sorted(layers) != list(range(len(layers))) or len(layers) == 0:
+        raise ValueError('the checkpoint does not contain the layers dense, dense_1, ...')
+    return [(layers[i]['kernel'], layers[i]['bias']) for i in range(len(layers))]
+
+def export_classifier(prefix, output = None, activation = 'elu', mean = None, scale = None):
+    """
+    Writes the dense layers of the checkpoint prefix to output (by default the prefix with the extension .npz,
+    e.g. final_nn_classifier_sim4.npz) and returns its path. mean and scale can be given for the networks trained
+    on standardized inputs (the StandardScaler of the notebooks), which are then standardized by the classifier.
+    """
+    if output is None:
+        output = os.path.splitext(prefix)[0] + '.npz'
+    arrays = {'activation': np.array(activation)}
+    for i, (kernel, bias) in enumerate(dense_layers(read_checkpoint(prefix))):
+        arrays['kernel_{}'.format(i)] = kernel
+        arrays['bias_{}'.format(i)] = bias
+    if mean is not None:
+        arrays['mean'] = np.asarray(mean, dtype = np.float32)
+        arrays['scale'] = np.asarray(scale, dtype = np.float32)
+    np.savez(output, **arrays)
+    return output
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Exports imitation learning classifier checkpoints to .npz')
+    parser.add_argument('checkpoints', nargs = '+', help = 'checkpoint prefixes, e.g. final_nn_classifier_sim4.ckpt')
+    parser.add_argument('--output', default = None, help = 'output file (only with a single checkpoint)')
+    args = parser.parse_args()
+    if args.output is not None and len(args.checkpoints) > 1:
+        parser.error('--output can only be used with a single checkpoint')
+    for prefix in args.checkpoints:
+        print(export_classifier(prefix, args.output))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+"""
+Generation of labelled datasets for the imitation learning classifier.
+
+States (tank loads) are sampled uniformly between 0 and the capacity of each tank, as in create_datasets() of the
+NN-Classifier-for-hardcoded-policy notebook, optionally evolved some days under the expert policy with the
+dynamics of the product delivery system (BatchSystem.step() of Q-learning/batch.py, i.e. the transitions of
+System.deterministic_action()), and labelled with leftmost_emptiest_tank_policy(). The work is split in
+shards, each one written to its own CSV file (same format as data/train.txt) by a process pool:
+
+    generate_dataset('data/train', 10**7, TANK_MAX_LOADS, TRUCK_MAX_LOADS[0], seed = 42)
+
+writes data/train-00000.txt, data/train-00001.txt, ... The output only depends on the seed and the shard size,
+not on the number of processes.
+"""
+import os
+import sys
+import argparse
+import multiprocessing as mp
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'Q-learning'))
+
+import model
+import tank
+import truck
+import config
+from batch import BatchSystem
+
+
+# Reward constants of the thesis, used when gym_pdsystem is not available (the labels do not use the rewards)
+REWARD_CONSTANTS = {'COEFF': 0.0075*740/1000*1.26, 'C_TRANSPORT': 0.1, 'C_LEVELS': 10.0, 'p0_GLOBAL': 0.7,
+                    'P1_GLOBAL': -10**3, 'P2_GLOBAL': -10**6, 'M_GLOBAL': 10, 'NOT_DELIVERYING_PENALTY': -10**6}
+
+
+def leftmost_emptiest_tank_policy(states, tank_max_loads, truck_max_load):
+    """
+    Vectorized version of the hard-coded policy of the notebook (one truck, k = 1) for states of shape (N, n):
+    returns for each state the leftmost tank with minimum load where the whole truck load fits, or n (stay at the
+    depot) if it does not fit in any of them.
+    """
+    states = np.asarray(states, dtype = np.float64)
+    n = states.shape[-1]
+    candidates = (states == states.min(axis = -1, keepdims = True)) & (states + truck_max_load <= tank_max_loads)
+    return np.where(candidates.any(axis = -1), candidates.argmax(axis = -1), n)
+
+def expert_system(tank_max_loads, truck_max_load, level_percentages):
+    """
+    Returns a model.System with the given tanks (loads 0, consumption rates given by level_percentages as in
+    Tank) and a single full truck at the depot that delivers its whole load, where the truck can go from any
+    position to any other one. The transport weights are 0, since the rewards are not used.
+    """
+    try:
+        config.load()
+    except ImportError:
+        config.configure(**REWARD_CONSTANTS)
+    n = len(tank_max_loads)
+    tanks = [tank.Tank(i, 0.0, max_load, 0, 1, np.asarray(percentages, dtype = np.float64))
+             for i, (max_load, percentages) in enumerate(zip(tank_max_loads, level_percentages))]
+    trucks = [truck.Truck(0, truck_max_load, truck_max_load, n, np.array([1.]), 1)]
+    graph = np.ones((n+1, n+1), dtype = np.int64)
+    weights = np.zeros((n+1, n+1), dtype = np.float64)
+    return model.System(tanks, trucks, graph, weights)
+
+def expert_step(batch, truck_max_load):
+    """
+    One day of all the copies of the BatchSystem batch (one truck) under the expert policy: the truck goes to the
+    tank chosen by leftmost_emptiest_tank_policy() (or stays at the depot) and delivers its largest load level,
+    with the transitions of System.deterministic_action(). Returns the actions (the chosen positions).
+    """
+    positions = leftmost_emptiest_tank_policy(batch.tank_loads, batch.tank_max_loads, truck_max_load)
+    actions = np.empty((batch.batch_size, 2), dtype = np.int64)
+    actions[:, 0] = positions
+    actions[:, 1] = batch.truck_n_levels[0] - 1
+    batch.step(actions)
+    return positions
+
+def check_arguments(tank_max_loads, level_percentages, steps):
+    """
+    Raises ValueError if steps is negative, or if the states have to be evolved (steps > 0) and level_percentages
+    does not give the [b, c, e] percentages of every tank
+    """
+    if steps < 0:
+        raise ValueError('steps must be >= 0')
+    if steps > 0:
+        if level_percentages is None:
+            raise ValueError('level_percentages are needed to evolve the states (steps > 0)')
+        if np.shape(level_percentages) != (len(tank_max_loads), 3):
+            raise ValueError('level_percentages must have shape (number of tanks, 3)')
+
+def sample_states(rng, n_samples, tank_max_loads, round_decimals = 5):
+    return np.round(rng.random((n_samples, len(tank_max_loads))) * tank_max_loads, round_decimals)
+
+def generate_shard(outputfile, n_samples, tank_max_loads, truck_max_load, seed, level_percentages = None,
+                   steps = 0, chunk_size = 10**5, round_decimals = 5):
+    """
+    Writes n_samples labelled rows to outputfile. seed can be an integer or a numpy.random.SeedSequence.
+    With steps > 0 every sampled state is first evolved that many days under the expert policy, starting with the
+    truck full at the depot (level_percentages gives the [b, c, e] percentages of each tank, which determine the
+    consumption rates as in Tank).
+    """
+    check_arguments(tank_max_loads, level_percentages, steps)
+    rng = np.random.default_rng(seed)
+    tank_max_loads = np.asarray(tank_max_loads, dtype = np.float64)
+    n = len(tank_max_loads)
+    if steps > 0:
+        system = expert_system(tank_max_loads, truck_max_load, level_percentages)
+
+    header = ','.join(['tank{}'.format(i+1) for i in range(n)] + ['target'])
+    fmt = ['%f'] * n + ['%d']
+    with open(outputfile, 'w') as f:
+        f.write(header + '\n')
+        for start in range(0, n_samples, chunk_size):
+            states = sample_states(rng, min(chunk_size, n_samples - start), tank_max_loads, round_decimals)
+            if steps > 0:
+                batch = BatchSystem(system, len(states))
+                batch.tank_loads[:] = states
+                for step in range(steps):
+                    expert_step(batch, truck_max_load)
+                states = batch.tank_loads
+            states = np.round(states, round_decimals)
+            targets = leftmost_emptiest_tank_policy(states, tank_max_loads, truck_max_load)
+            rows = np.empty((len(states), n + 1), dtype = object)
+            rows[:, :n] = states
+            rows[:, n] = targets
+            np.savetxt(f, rows, fmt = fmt, delimiter = ',')
+    return outputfile
+
+def _generate_shard(args):
+    return generate_shard(*args[:5], **args[5])
+
+def generate_dataset(out_prefix, n_samples, tank_max_loads, truck_max_load, seed = 42, shard_size = 10**6,
+                     n_workers = None, **kwargs):
+    """
+    Generates n_samples labelled rows in shards of shard_size rows, written in parallel to
+    '{out_prefix}-{shard:05d}.txt'. Shard i uses the i-th child of numpy.random.SeedSequence(seed).
+    Extra keyword arguments are passed to generate_shard(). Returns the list of files.
+    """
+    check_arguments(tank_max_loads, kwargs.get('level_percentages'), kwargs.get('steps', 0))
+    n_shards = max(1, -(-n_samples // shard_size))
+    seeds = np.random.SeedSequence(seed).spawn(n_shards)
+    directory = os.path.dirname(out_prefix)
+    if directory:
+        os.makedirs(directory, exist_ok = True)
+
+    tasks = []
+    for shard in range(n_shards):
+        size = min(shard_size, n_samples - shard * shard_size)
+        outputfile = '{}-{:05d}.txt'.format(out_prefix, shard)
+        tasks.append((outputfile, size, tank_max_loads, truck_max_load, seeds[shard], kwargs))
+
+    with mp.Pool(n_workers) as pool:
+        return pool.map(_generate_shard, tasks)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Generate labelled data with the leftmost emptiest tank policy.')
+    parser.add_argument('out_prefix')
+    parser.add_argument('n_samples', type = int)
+    parser.add_argument('--tank-max-loads', type = float, nargs = '+', default = [100., 200., 100.])
+    parser.add_argument('--truck-max-load', type = float, default = 50.)
+    parser.add_argument('--level-percentages', type = float, nargs = '+', default = None,
+                        help = 'b c e percentages of each tank, flattened (needed with --steps)')
+    parser.add_argument('--steps', type = int, default = 0)
+    parser.add_argument('--seed', type = int, default = 42)
+    parser.add_argument('--shard-size', type = int, default = 10**6)
+    parser.add_argument('--workers', type = int, default = None)
+    args = parser.parse_args()
+
+    level_percentages = None
+    if args.level_percentages is not None:
+        if len(args.level_percentages) != 3 * len(args.tank_max_loads):
+            parser.error('--level-percentages needs 3 values (b c e) per tank')
+        level_percentages = np.reshape(args.level_percentages, (-1, 3))
+    elif args.steps > 0:
+        parser.error('--level-percentages is needed with --steps')
+    if args.steps < 0:
+        parser.error('--steps must be >= 0')
+    files = generate_dataset(args.out_prefix, args.n_samples, args.tank_max_loads, args.truck_max_load,
+                             seed = args.seed, shard_size = args.shard_size, n_workers = args.workers,
+                             level_percentages = level_percentages, steps = args.steps)
+    print('\n'.join(files))
@@ -0,0 +1,107 @@
+"""
+Pure NumPy inference of the imitation learning classifiers exported by export_classifier.py, for serving dispatch
+decisions without TensorFlow (importing this module only imports NumPy):
+
+    classifier = MLPClassifier.load('simulations/simulation4/final_nn_classifier_sim4.npz')
+    actions = classifier.predict(tank_loads)          # tank_loads of shape (batch, n) or (n,)
+    action = classifier.predict_one([36.5, 90.2, 49.6])
+
+The computations are done in float32, as in the TensorFlow graph of the notebooks (the action is the argmax of
+the logits, i.e. of the softmax outputs).
+"""
+import numpy as np
+
+
+class MLPClassifier():
+    """
+    Multilayer perceptron with the given (kernel, bias) layers: activation (ELU) in all the hidden layers and
+    a linear output layer. If mean and scale are given the inputs are standardized first.
+    """
+    def __init__(self, layers, activation = 'elu', mean = None, scale = None):
+        if activation not in ('elu', 'relu'):
+            raise ValueError("activation must be 'elu' or 'relu'")
+        self.kernels = [np.ascontiguousarray(kernel, dtype = np.float32) for kernel, bias in layers]
+        self.biases = [np.ascontiguousarray(bias, dtype = np.float32) for kernel, bias in layers]
+        self.activation = activation
+        self.mean = None if mean is None else np.asarray(mean, dtype = np.float32)
+        self.scale = None if scale is None else np.asarray(scale, dtype = np.float32)
+        self.n_inputs = self.kernels[0].shape[0]
+        self.n_outputs = self.kernels[-1].shape[1]
+        # Preallocated outputs of every layer for predict_one()
+        self._outputs = [np.empty(kernel.shape[1], dtype = np.float32) for kernel in self.kernels]
+        self._negatives = [np.empty(kernel.shape[1], dtype = np.float32) for kernel in self.kernels]
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            n_layers = len([name for name in data.files if name.startswith('kernel_')])
+            layers = [(data['kernel_{}'.format(i)], data['bias_{}'.format(i)]) for i in range(n_layers)]
+            mean = data['mean'] if 'mean' in data.files else None
+            scale = data['scale'] if 'scale' in data.files else None
+            return cls(layers, str(data['activation']), mean, scale)
+
+    def _activate(self, x):
+        if self.activation == 'elu':
+            # elu(x) = x if x > 0 else exp(x) - 1
+            return np.where(x > 0, x, np.expm1(np.minimum(x, 0)))
+        return np.maximum(x, 0, out = x)
+
+    def logits(self, X):
+        """
+        Returns the logits of the inputs X of shape (batch, n_inputs) or (n_inputs,)
+        """
+        x = np.asarray(X, dtype = np.float32)
+        if self.mean is not None:
+            x = (x - self.mean) / self.scale
+        last = len(self.kernels) - 1
+        for i, (kernel, bias) in enumerate(zip(self.kernels, self.biases)):
+            x = x @ kernel
+            x += bias
+            if i < last:
+                x = self._activate(x)
+        return x
+
+    def probabilities(self, X):
+        """
+        Returns the softmax of the logits (the outputs of the networks of the notebooks)
+        """
+        logits = self.logits(X)
+        exp = np.exp(logits - logits.max(axis = -1, keepdims = True))
+        return exp / exp.sum(axis = -1, keepdims = True)
+
+    def predict(self, X):
+        """
+        Returns the actions (tank to go to, or n to stay at the depot) for the inputs X, shape (batch,) or ()
+        """
+        return np.argmax(self.logits(X), axis = -1)
+
+    def predict_one(self, x):
+        """
+        Action for a single state, as a Python integer. Same result as predict(), with every operation writing
+        into preallocated arrays to keep the latency of a single decision low (not thread-safe).
+        """
+        x = np.asarray(x, dtype = np.float32)
+        if self.mean is not None:
+            x = (x - self.mean) / self.scale
+        last = len(self.kernels) - 1
+        for i, (kernel, bias) in enumerate(zip(self.kernels, self.biases)):
+            out = self._outputs[i]
+            np.dot(x, kernel, out = out)
+            np.add(out, bias, out = out)
+            if i < last:
+                if self.activation == 'elu':
+                    negative = self._negatives[i]
+                    np.minimum(out, 0, out = negative)
+                    np.expm1(negative, out = negative)
+                    np.maximum(out, 0, out = out)
+                    np.add(out, negative, out = out)
+                else:
+                    np.maximum(out, 0, out = out)
+            x = out
+        return int(np.argmax(x))
+
+    def policy(self, tank_loads, rng = None):
+        """
+        Same as predict(); usable as the choose function of evaluation.movement_policy() (k = 1)
+        """
+        return self.predict(tank_loads)
@@ -0,0 +1,140 @@
+"""
+Parallel collection of episodes for Policy Gradient training.
+
+Example (the environment factory and the policy must be picklable, e.g. module-level functions):
+
+    def make_env():
+        env = gym.make("PDSystemEnv-v0")
+        env._max_episode_steps = episode_length
+        return env
+
+    with RolloutPool(make_env, policy, max_steps = episode_length, n_episodes = n_games_per_update, seed = 42) as pool:
+        rewards, actions, observations, lengths = pool.collect()
+        all_disc_rewards = discount_rewards(rewards, discount_rate, lengths)
+
+where policy(obs, rng) returns the integer action (in range((n+1)^k)) for the observation obs, using the
+numpy.random.Generator rng for any sampling.
+"""
+import random
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from utils_pg import int_to_action
+
+
+# Per-process state of the workers (set by _init_worker)
+_worker = {}
+
+def _attach(name, shape, dtype):
+    shm = shared_memory.SharedMemory(name = name)
+    return shm, np.ndarray(shape, dtype = dtype, buffer = shm.buf)
+
+def _init_worker(make_env, policy, buffers):
+    _worker['env'] = make_env()
+    _worker['policy'] = policy
+    _worker['shm'] = []
+    for key, (name, shape, dtype) in buffers.items():
+        shm, array = _attach(name, shape, dtype)
+        _worker['shm'].append(shm)
+        _worker[key] = array
+
+def episode_rng(seed, episode):
+    """
+    Returns the random generator of a given episode, which only depends on (seed, episode) and not on the worker
+    that simulates it.
+    """
+    return np.random.default_rng(np.random.SeedSequence([seed, episode]))
+
+def run_episode(env, policy, rng, rewards, actions, observations):
+    """
+    Simulates one episode of at most len(rewards) steps, writing the rewards, the integer actions and the
+    observations seen before each action into the given rows. Returns the number of steps of the episode.
+    The global NumPy and Python generators (used by the gym environment on reset) are seeded from rng.
+    """
+    np.random.seed(rng.integers(2**32))
+    random.seed(int(rng.integers(2**32)))
+
+    obs = env.reset()
+    steps = 0
+    for step in range(len(rewards)):
+        observations[step] = np.ravel(obs)
+        action = policy(obs, rng)
+        obs, reward, done, info = env.step(int_to_action(action, env))
+        rewards[step] = reward
+        actions[step] = action
+        steps = step + 1
+        if done:
+            break
+    return steps
+
+def _run_episode(args):
+    row, seed, episode = args
+    rng = episode_rng(seed, episode)
+    _worker['lengths'][row] = run_episode(_worker['env'], _worker['policy'], rng, _worker['rewards'][row],
+                                          _worker['actions'][row], _worker['observations'][row])
+    return row
+
+
+class RolloutPool():
+    """
+    Pool of worker processes that simulate episodes in parallel. Each worker builds its own environment with
+    make_env(), and the results are written to shared memory arrays of shape (n_episodes, max_steps) (rewards and
+    actions) and (n_episodes, max_steps, obs_size) (observations), padded with zeros after the end of each episode.
+
+    Episode i of a collect() call with first_episode = e uses the generator episode_rng(seed, e + i), so the
+    results are the same for a given seed whatever the number of workers.
+    """
+    def __init__(self, make_env, policy, max_steps, n_episodes, seed = 42, n_workers = None, obs_size = None):
+        if obs_size is None:
+            obs_size = np.asarray(make_env().reset()).size
+        self.max_steps = max_steps
+        self.n_episodes = n_episodes
+        self.seed = seed
+
+        specs = {'rewards': ((n_episodes, max_steps), np.float64),
+                 'actions': ((n_episodes, max_steps), np.int64),
+                 'observations': ((n_episodes, max_steps, obs_size), np.float64),
+                 'lengths': ((n_episodes,), np.int64)}
+        self._shm = []
+        self.arrays = {}
+        buffers = {}
+        for key, (shape, dtype) in specs.items():
+            nbytes = max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize)
+            shm = shared_memory.SharedMemory(create = True, size = nbytes)
+            self._shm.append(shm)
+            self.arrays[key] = np.ndarray(shape, dtype = dtype, buffer = shm.buf)
+            buffers[key] = (shm.name, shape, dtype)
+
+        self.pool = mp.Pool(n_workers, initializer = _init_worker, initargs = (make_env, policy, buffers))
+
+    def collect(self, first_episode = 0, copy = True):
+        """
+        Simulates n_episodes episodes in parallel and returns the arrays (rewards, actions, observations, lengths).
+        With copy = False the shared arrays themselves are returned, which are overwritten by the next call.
+        """
+        for array in self.arrays.values():
+            array.fill(0)
+        tasks = [(row, self.seed, first_episode + row) for row in range(self.n_episodes)]
+        self.pool.map(_run_episode, tasks)
+
+        arrays = [self.arrays[key] for key in ('rewards', 'actions', 'observations', 'lengths')]
+        if copy:
+            arrays = [array.copy() for array in arrays]
+        return tuple(arrays)
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+        self.arrays = {}
+        for shm in self._shm:
+            shm.close()
+            shm.unlink()
+        self._shm = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
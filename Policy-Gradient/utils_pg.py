@@ -1,88 +1,140 @@
 import numpy as np
 
-def int_to_action(int_action: int, env):
+def action_strides(nplus1, k):
+    """
+    Place values of the mixed-radix (base n+1) encoding of k-dimensional actions: the first truck is the most
+    significant digit, i.e. [(n+1)^(k-1), ..., n+1, 1].
+    """
+    return (nplus1 ** np.arange(k-1, -1, -1)).astype(np.int64)
+
+def int_to_action(int_action, env):
     """
-    So far assumed k = 2, 3 or 4:
-    
     Converts an integer between 0 and env.action_space.shape[1]**env.action_space.shape[0]
-    which is (n+1)^k where n is the number of tanks and k the number of trucks.
+    which is (n+1)^k where n is the number of tanks and k the number of trucks (any k).
     
     return vect_action: a k-dimensional vector with components in the range 0,...n. 
-    For k = 2, vect_action = [i,j] is the action of truck 1 going to tank i and truck 2 going to tank j.
-    (i, j = n means staying at the depot, 0,....,n-1 are the real tanks).
-    The associated integer is i*(n+1) + j
+    vect_action = [i_1,...,i_k] is the action of truck 1 going to tank i_1, ..., truck k going to tank i_k
+    (i_j = n means staying at the depot, 0,....,n-1 are the real tanks).
+    The associated integer is (...(i_1*(n+1) + i_2)*(n+1) + ...)*(n+1) + i_k
+    For k = 2 it is i*(n+1) + j, for k = 3 (i*(n+1) + j)*(n+1) + l, and so on.
     
-    For k = 3, vect_action = [i,j,l] is the action of truck 1 going to tank i, truck 2 going to tank j,
-    and truck 3 going to tank l.
-    (i, j, l = n means staying at the depot, 0,....,n-1 are the real tanks).
-    The associated integer is (i*(n+1) + j)*(n+1) + l
-    
-    For k = 4, vect_action = [i,j,l,m] is the action of truck 1 going to tank i, truck 2 going to tank j,
-    truck 3 going to tank l and truck 4 going to tank m.
-    (i, j, l, m = n means staying at the depot, 0,....,n-1 are the real tanks).
-    The associated integer is ((i*(n+1) + j)*(n+1) + l)*(n+1) + m
-
+    int_action can also be an array of integers of any shape, in which case an array of shape
+    int_action.shape + (k,) is returned (e.g. (N, k) for shape (N,), also when N = 1). Only the (1, 1) output
+    of tf.multinomial is decoded to a vector of shape (k,), as for a scalar.
     """
     nplus1 = env.action_space.shape[1]
     k = env.action_space.shape[0]
-    n_actions = nplus1**k
     
-    if k == 2:
-        j = int_action % nplus1
-        i = int((int_action-j)/nplus1)
-        vect_action = np.array([i,j])
-      
-    elif k == 3:
-        l = int_action % nplus1
-        ij = int( (int_action - l)/nplus1 ) 
-        j = ij % nplus1
-        i = int((ij-j)/nplus1)
-        vect_action = np.array([i,j,l])
-        
-    elif k == 4:
-        m = int_action % nplus1
-        ml = int((int_action - m)/nplus1)
-        l = ml % nplus1
-        ij = int((ml-l)/nplus1) 
-        j = ij % nplus1
-        i = int((ij-j)/nplus1)
-        vect_action = np.array([i,j,l,m])
+    int_action = np.asarray(int_action, dtype = np.int64)
+    if int_action.ndim == 2 and int_action.shape == (1, 1):
+        int_action = int_action.reshape(())
+    if np.any(int_action < 0) or np.any(int_action >= nplus1**k):
+        raise ValueError("The integer action is out of the range 0,...,(n+1)^k - 1")
     
-    else:
-        raise ValueError("The number of trucks k of the environment is different from 2, 3 or 4")
+    vect_action = (int_action[..., None] // action_strides(nplus1, k)) % nplus1
     return vect_action
 
 def action_to_int(vect_action: np.array, env):
     """
-    Assumed k = 2,3 or 4, so vect_action has 2, 3 or components respectively.
+    Inverse of int_to_action(): converts a k-dimensional action vector (any k) to its integer.
+    vect_action can also be an array of shape (..., k), in which case an array of shape (...) is returned.
     """
     nplus1 = env.action_space.shape[1]
     k = env.action_space.shape[0]
-    if k == 2:
-        int_action = vect_action[0] * nplus1 + vect_action[1]
-    elif k == 3:
-        int_action = (vect_action[0] * nplus1 + vect_action[1])*nplus1 + vect_action[2]
-    elif k == 4:
-        int_action = ((vect_action[0] * nplus1 + vect_action[1])*nplus1 + vect_action[2])*nplus1 + vect_action[3] 
-    else:
-        raise ValueError("The number of trucks k of the environment is different from 2, 3 or 4")
-
+    
+    vect_action = np.asarray(vect_action, dtype = np.int64)
+    if vect_action.shape[-1] != k:
+        raise ValueError("The action vectors must have k = {} components".format(k))
+    
+    int_action = vect_action @ action_strides(nplus1, k)
     return int_action
 
+def mask_probabilities(probas, mask):
+    """
+    Sets to zero the probabilities of the actions not allowed by the boolean mask (e.g. System.joint_action_mask())
+    and renormalizes them, so that sampling never picks an infeasible action. probas and mask can have shape
+    ((n+1)^k,) or (batch, (n+1)^k). Rows where the policy gives zero probability to all the allowed actions
+    become uniform over the allowed actions (and all zeros if no action is allowed).
+    """
+    probas = np.where(mask, probas, 0.0)
+    total = probas.sum(axis = -1, keepdims = True)
+    uniform = mask / np.maximum(mask.sum(axis = -1, keepdims = True), 1)
+    return np.where(total > 0, probas / np.where(total > 0, total, 1.0), uniform)
+
 #####################################################
 """
 Adapted from https://github.com/ageron/handson-ml 
 """
 
-def discount_rewards(rewards, discount_rate):
-    discounted_rewards = np.zeros(len(rewards))
-    cumulative_rewards = 0
-    for step in reversed(range(len(rewards))):
-        cumulative_rewards = rewards[step] + cumulative_rewards * discount_rate
-        discounted_rewards[step] = cumulative_rewards
+def lengths_to_mask(lengths, n_steps):
+    """
+    Boolean mask of shape (episodes, n_steps) which is True for the first lengths[i] steps of each episode.
+    """
+    return np.arange(n_steps) < np.asarray(lengths)[:, None]
+
+def discount_rewards(rewards, discount_rate, lengths = None):
+    """
+    Discounted returns of the rewards of an episode (1-D array) or of a padded 2-D (episodes x steps) array of
+    rewards, where lengths (or a boolean mask of the same shape) tells the number of valid steps of each episode.
+    Padded steps are ignored and set to 0 in the output.
+    
+    The returns are computed with vectorized reversed cumulative sums over blocks of steps short enough for the
+    powers of the discount rate not to underflow, instead of a Python loop over the steps.
+    """
+    rewards = np.array(rewards, dtype = np.float64)
+    one_episode = rewards.ndim == 1
+    rewards = np.atleast_2d(rewards)
+    if lengths is not None:
+        mask = np.asarray(lengths)
+        if mask.dtype != bool:
+            mask = lengths_to_mask(mask, rewards.shape[1])
+        rewards[~mask] = 0.0
+    
+    n_steps = rewards.shape[1]
+    if discount_rate == 0 or n_steps == 0:
+        discounted_rewards = rewards
+    elif discount_rate == 1:
+        discounted_rewards = np.cumsum(rewards[:, ::-1], axis = 1)[:, ::-1]
+    else:
+        # discount_rate**block stays within [1e-100, 1e100]
+        block = max(1, int(230 / abs(np.log(abs(discount_rate)))))
+        discounted_rewards = np.empty_like(rewards)
+        cumulative_rewards = np.zeros(rewards.shape[0])
+        for end in range(n_steps, 0, -block):
+            start = max(0, end - block)
+            powers = discount_rate ** np.arange(end - start)
+            partial = np.cumsum((rewards[:, start:end] * powers)[:, ::-1], axis = 1)[:, ::-1]
+            discounted_rewards[:, start:end] = (partial / powers 
+                                                + cumulative_rewards[:, None] * (discount_rate * powers[::-1]))
+            cumulative_rewards = discounted_rewards[:, start]
+    
+    if one_episode:
+        return discounted_rewards[0]
     return discounted_rewards
 
-def normalize_rewards(all_discounted_rewards): #, discount_rate):
+def normalize_rewards(all_discounted_rewards, lengths = None): #, discount_rate):
+    """
+    Normalizes the discounted rewards of several episodes with the mean and standard deviation of all their steps.
+    
+    all_discounted_rewards can be a list of 1-D arrays (a list of normalized arrays is returned), or a padded
+    2-D (episodes x steps) array together with the lengths of the episodes (or a boolean mask): then only the
+    valid steps are used, the array is normalized in place (padded steps are set to 0) and returned.
+    """
+    if isinstance(all_discounted_rewards, np.ndarray) and all_discounted_rewards.ndim == 2:
+        rewards = all_discounted_rewards
+        if lengths is None:
+            mask = np.ones(rewards.shape, dtype = bool)
+        else:
+            mask = np.asarray(lengths)
+            if mask.dtype != bool:
+                mask = lengths_to_mask(mask, rewards.shape[1])
+        reward_mean = np.mean(rewards, where = mask)
+        reward_std = np.std(rewards, where = mask)
+        np.subtract(rewards, reward_mean, out = rewards)
+        np.divide(rewards, reward_std, out = rewards)
+        rewards[~mask] = 0.0
+        return rewards
+    
     #all_discounted_rewards = [discount_rewards(rewards, discount_rate) for rewards in all_rewards]
     flat_rewards = np.concatenate(all_discounted_rewards)
     reward_mean = flat_rewards.mean()
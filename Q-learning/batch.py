@@ -0,0 +1,243 @@
+import numpy as np
+
+import rewards as rw
+import kernels
+from tank import LevelIndex
+import config
+
+
+class BatchSystem():
+    """
+    Struct-of-arrays version of model.System that holds batch_size copies of the same scenario (same tanks,
+    trucks and graph) and steps all of them with one call.
+
+    Tank loads have shape (batch_size, n) and truck loads and positions shape (batch_size, k); all the copies
+    start from the current state of the given system. step() follows the transition and reward rules of
+    System.deterministic_action() for every copy of the batch.
+
+    With use_kernel = True (the default when Numba is installed) the movement, delivery and consumption are
+    done by the compiled loops of kernels.py instead of NumPy operations over the batch, with identical results.
+    """
+    def __init__(self, system, batch_size, seed = None, use_kernel = kernels.HAVE_NUMBA):
+        self.n = system.n
+        self.k = system.k
+        self.batch_size = batch_size
+        self.graph = np.asarray(system.graph)
+        self.weights = system.weights_array
+        self.rng = np.random.default_rng(seed)
+        self.use_kernel = use_kernel
+
+        self.tank_max_loads = np.array(system.tank_max_loads(), dtype = np.float64)
+        self.tank_rates = np.array(system.tank_rates(), dtype = np.float64)
+        self.tank_stochastic = np.array([tank.stochastic for tank in system.tanks], dtype = bool)
+        self.tank_level_percentages = np.array([tank.level_percentages for tank in system.tanks],
+                                               dtype = np.float64)
+        self.level_breakpoints = np.array(system.level_breakpoints)
+        self.level_coefficients = np.array(system.level_coefficients)
+        self.truck_max_loads = np.array(system.truck_max_loads(), dtype = np.float64)
+        self.truck_levels = [np.asarray(truck.levels, dtype = np.float64) for truck in system.trucks]
+        self.truck_n_levels = np.array([len(levels) for levels in self.truck_levels], dtype = np.int64)
+        self.tanks_level_table = np.array(system.tanks_level_table)
+        self.trucks_level_table = np.array(system.trucks_level_table)
+        self.tanks_level_index = LevelIndex(self.tanks_level_table)
+        self.trucks_level_index = LevelIndex(self.trucks_level_table)
+        # Mixed-radix encoding of the discrete states (System.state_to_int()) as int64, see state_codes()
+        int64_max = np.iinfo(np.int64).max
+        self.state_strides = None
+        self.action_strides = None
+        self.action_radices = np.array(system.action_radices, dtype = np.int64)
+        if system.states_code_dim <= int64_max:
+            self.state_strides = np.array(system.state_strides, dtype = np.int64)
+        if system.actions_code_dim <= int64_max:
+            self.action_strides = np.array(system.action_strides, dtype = np.int64)
+
+        self.tank_loads = np.tile(np.array(system.tank_loads(), dtype = np.float64), (batch_size, 1))
+        self.truck_loads = np.tile(np.array(system.truck_loads(), dtype = np.float64), (batch_size, 1))
+        self.truck_positions = np.tile(np.array(system.truck_positions(), dtype = np.int64), (batch_size, 1))
+
+        # Last action taken by every copy of the system (as System.da and System.a)
+        self.positions = self.truck_positions.copy()
+        self.delivery_indices = np.zeros((batch_size, self.k), dtype = np.int64)
+        self.deliveries = np.zeros((batch_size, self.k), dtype = np.float64)
+
+    def state(self):
+        """
+        Returns the current (continuous) state of the batch: truck positions, truck loads and tank loads.
+        """
+        return([self.truck_positions, self.truck_loads, self.tank_loads])
+
+    def discrete_state(self):
+        """
+        Returns the current discretized state of the batch: truck positions, truck load levels (batch_size, k)
+        and tank load levels (batch_size, n).
+        """
+        truck_lvls = self.trucks_level_index.lvls(self.truck_loads)
+        return([self.truck_positions.copy(), truck_lvls, self.tank_lvls()])
+
+    def state_codes(self):
+        """
+        Returns the integer code of the discrete state of every copy of the system (as System.state_to_int()),
+        shape (batch_size,). Raises ValueError if the codes do not fit in 64 bits.
+        """
+        if self.state_strides is None:
+            raise ValueError('state codes do not fit in 64 bits')
+        digits = np.concatenate(self.discrete_state(), axis = 1)
+        return(digits @ self.state_strides)
+
+    def int_to_actions(self, codes):
+        """
+        Decodes an array of action codes (System.action_to_int()) to actions of shape codes.shape + (2k,)
+        """
+        if self.action_strides is None:
+            raise ValueError('action codes do not fit in 64 bits')
+        codes = np.asarray(codes, dtype = np.int64)
+        return((codes[..., None] // self.action_strides) % self.action_radices)
+
+    def random_actions(self, rng, rows = None):
+        """
+        Returns random actions of shape (len(rows), 2k) for the given copies of the system (all by default): every
+        truck moves to a position chosen uniformly among the ones allowed by the graph (it stays if there is none)
+        and gets a delivery level index chosen uniformly among its load levels.
+        """
+        if rows is None:
+            rows = np.arange(self.batch_size)
+        actions = np.empty((len(rows), 2*self.k), dtype = np.int64)
+        for i in range(self.k):
+            positions = self.truck_positions[rows, i]
+            feasible = self.graph[positions] == 1
+            counts = np.count_nonzero(feasible, axis = 1)
+            choices = np.floor(rng.random(len(rows)) * counts).astype(np.int64)
+            new_positions = np.argmax(np.cumsum(feasible, axis = 1) > choices[:, None], axis = 1)
+            actions[:, i] = np.where(counts > 0, new_positions, positions)
+            actions[:, self.k + i] = rng.integers(self.truck_n_levels[i], size = len(rows))
+        return(actions)
+
+    def tank_lvls(self):
+        """
+        Returns the discrete levels of the loads of all the tanks of the batch, shape (batch_size, n)
+        """
+        return(self.tanks_level_index.lvls(self.tank_loads))
+
+    def reset_trucks_positions(self):
+        self.truck_positions[:] = self.n
+
+    def reset_trucks_loads(self):
+        self.truck_loads[:] = self.truck_max_loads
+
+    def number_of_tanks_empty(self):
+        """
+        Returns, for every copy of the system, the number of tanks that are empty (i.e., with load less than zero)
+        """
+        return(np.count_nonzero(self.tank_loads <= 0, axis = 1))
+
+    def consume(self):
+        """
+        Updates the loads of all the tanks of the batch according to their consumption rates
+        """
+        rates = self.tank_rates
+        if self.tank_stochastic.any():
+            noise = self.rng.uniform(-1, 1, size = self.tank_loads.shape)
+            rates = np.where(self.tank_stochastic, rates + rates * 0.10 * noise, rates)
+        np.maximum(0, self.tank_loads - rates, out = self.tank_loads)
+
+    def R_levels(self, p0 = None, M = None, P1 = None, P2 = None):
+        """
+        Returns the level rewards (System.R_levels()) of every copy of the system, shape (batch_size,).
+        """
+        p0 = config.p0_GLOBAL if p0 is None else p0
+        M = config.M_GLOBAL if M is None else M
+        P1 = config.P1_GLOBAL if P1 is None else P1
+        P2 = config.P2_GLOBAL if P2 is None else P2
+        if p0 == config.p0_GLOBAL:
+            breakpoints = self.level_breakpoints
+        else:
+            breakpoints = rw.level_breakpoints(self.tank_level_percentages, p0)
+
+        return(rw.R_levels(self.tank_loads, self.tank_max_loads, breakpoints, P1, P2, M))
+
+    def step(self, actions):
+        """
+        Applies one action per copy of the system. actions has shape (batch_size, 2k) (or (2k,) to apply the same
+        action to all of them), with the k new truck positions followed by the k delivery level indices, as
+        in System.deterministic_action().
+
+        Returns the arrays (rewards, transport_rewards, level_rewards, trucks_not_deliverying), each of shape
+        (batch_size,).
+        """
+        actions = np.broadcast_to(np.asarray(actions, dtype = np.int64), (self.batch_size, 2*self.k))
+        if self.use_kernel:
+            return(self._kernel_step(actions))
+        new_positions = actions[:, :self.k]
+        delivery_indices = actions[:, self.k:].copy()
+
+        # System.deterministic_action() stores the transport weights in an integer array
+        kernels.check_weights(self.weights, self.truck_positions, actions)
+        w_t = self.weights[self.truck_positions, new_positions].astype(np.int64)
+        self.truck_positions[:] = new_positions
+
+        rows = np.arange(self.batch_size)
+        deliveries = np.zeros((self.batch_size, self.k), dtype = np.float64)
+        trucks_not_deliverying = np.zeros(self.batch_size, dtype = np.int64)
+
+        # Trucks are processed in order, so that several trucks visiting the same tank see its updated load
+        for i in range(self.k):
+            positions = new_positions[:, i]
+            at_tank = positions != self.n
+            indices = np.where(at_tank, delivery_indices[:, i], 0)
+            delivery_quantity = np.where(at_tank, self.truck_levels[i][indices], 0.0)
+            self.truck_loads[:, i] = self.truck_loads[:, i] - delivery_quantity
+
+            tanks = np.where(at_tank, positions, 0)
+            hipothetic_next_load = self.tank_loads[rows, tanks] + delivery_quantity
+            fits = hipothetic_next_load <= self.tank_max_loads[tanks]
+            deliver = at_tank & fits
+            self.tank_loads[rows[deliver], tanks[deliver]] = hipothetic_next_load[deliver]
+            trucks_not_deliverying = trucks_not_deliverying + (at_tank & ~fits)
+
+            delivery_indices[:, i] = indices
+            deliveries[:, i] = delivery_quantity
+
+        self.consume()
+
+        self.positions = new_positions.copy()
+        self.delivery_indices = delivery_indices
+        self.deliveries = deliveries
+
+        return(self._rewards(w_t, deliveries, trucks_not_deliverying))
+
+    def _kernel_step(self, actions):
+        kernels.check_actions(actions, self.n, self.k, self.truck_n_levels)
+        kernels.check_weights(self.weights, self.truck_positions, actions)
+        actions = np.ascontiguousarray(actions)
+        w_t = np.empty((self.batch_size, self.k), dtype = np.int64)
+        deliveries = np.empty((self.batch_size, self.k), dtype = np.float64)
+        delivery_indices = np.empty((self.batch_size, self.k), dtype = np.int64)
+        trucks_not_deliverying = np.empty(self.batch_size, dtype = np.int64)
+        kernels.move_and_deliver(self.tank_loads, self.truck_loads, self.truck_positions, actions, self.weights,
+                                 self.trucks_level_table, self.tank_max_loads,
+                                 w_t, deliveries, delivery_indices, trucks_not_deliverying)
+
+        if self.tank_stochastic.any():
+            noise = self.rng.uniform(-1, 1, size = self.tank_loads.shape)
+        else:
+            noise = np.empty((0, 0))
+        kernels.consume(self.tank_loads, self.tank_rates, self.tank_stochastic, noise)
+
+        self.positions = actions[:, :self.k].copy()
+        self.delivery_indices = delivery_indices
+        self.deliveries = deliveries
+
+        R_levels = kernels.R_levels(self.tank_loads, self.tank_max_loads, self.level_breakpoints,
+                                    self.level_coefficients)
+        return(self._rewards(w_t, deliveries, trucks_not_deliverying, R_levels))
+
+    def _rewards(self, w_t, deliveries, trucks_not_deliverying, R_levels = None):
+        if R_levels is None:
+            R_levels = self.R_levels()
+        transport_rewards = config.C_TRANSPORT * (config.COEFF * np.sum(w_t * deliveries, axis = 1))
+        level_rewards = config.C_LEVELS * R_levels
+        extra_rewards = config.C_LEVELS * trucks_not_deliverying * config.NOT_DELIVERYING_PENALTY
+
+        rewards = level_rewards - transport_rewards + extra_rewards
+
+        return(rewards, transport_rewards, level_rewards, trucks_not_deliverying)
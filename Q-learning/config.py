@@ -0,0 +1,42 @@
+"""
+Constants of the rewards of the product delivery system (COEFF, C_TRANSPORT, C_LEVELS, p0_GLOBAL, P1_GLOBAL,
+P2_GLOBAL, M_GLOBAL and NOT_DELIVERYING_PENALTY).
+
+By default they are the ones of gym_pdsystem.utils.constants, which is only imported the first time one of them is
+used (e.g. when a System is created), so that importing the simulator does not import gym_pdsystem. They can also
+be set explicitly with configure() before creating any System, e.g. in worker processes or tools that do not
+need gym:
+
+    import config
+    config.configure(COEFF = 0.0075*740/1000*1.26, C_TRANSPORT = 0.1, C_LEVELS = 10.0, p0_GLOBAL = 0.7,
+                     P1_GLOBAL = -10**3, P2_GLOBAL = -10**6, M_GLOBAL = 10, NOT_DELIVERYING_PENALTY = -10**6)
+"""
+
+NAMES = ('COEFF', 'C_TRANSPORT', 'C_LEVELS', 'p0_GLOBAL', 'P1_GLOBAL', 'P2_GLOBAL', 'M_GLOBAL',
+         'NOT_DELIVERYING_PENALTY')
+
+
+def configure(**constants):
+    """
+    Sets the given constants; the other ones keep their values (or are read from gym_pdsystem when first used).
+    Systems created before keep the level reward breakpoints of the previous values.
+    """
+    unknown = set(constants) - set(NAMES)
+    if unknown:
+        raise ValueError('unknown constants: {}'.format(', '.join(sorted(unknown))))
+    globals().update(constants)
+
+def load():
+    """
+    Reads from gym_pdsystem.utils.constants the constants that have not been configured
+    """
+    import gym_pdsystem.utils.constants as ct
+    for name in NAMES:
+        if name not in globals():
+            globals()[name] = getattr(ct, name)
+
+def __getattr__(name):
+    if name in NAMES:
+        load()
+        return(globals()[name])
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
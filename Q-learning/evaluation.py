@@ -0,0 +1,192 @@
+"""
+Batched evaluation of policies over many seeded episodes.
+
+The episodes are simulated batch_size at a time with BatchSystem (same transitions and rewards as
+System.deterministic_action()), and evaluate() returns per-episode arrays and their aggregate statistics, with no
+plotting in the loop:
+
+    results = evaluate(system, greedy_policy(Q), n_episodes = 10**4, episode_length = 30, seed = 42)
+    results['summary']['rewards']['mean'], results['summary']['stockouts']['quantiles']
+
+A policy is a function policy(batch, rng) that returns the actions of shape (batch.batch_size, 2k) for the current
+state of the BatchSystem batch (the k new truck positions followed by the k delivery level indices, as in
+System.deterministic_action()); rng is a numpy.random.Generator for any sampling. greedy_policy() builds one from
+a Q-table and movement_policy() from a function of the tank loads, such as the policy gradient network or the
+imitation learning classifier.
+"""
+import numpy as np
+
+import kernels
+from batch import BatchSystem
+from qtable import ArrayQTable
+
+
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+# Per-episode statistics returned by evaluate()
+EPISODE_STATISTICS = ('rewards', 'transport_rewards', 'level_rewards', 'trucks_not_deliverying', 'stockouts',
+                      'trucks_sent')
+
+
+def initial_tank_loads(system, rng, size):
+    """
+    Returns random initial tank loads of shape (size, n), uniform between levels[0]+1 and levels[-1] of every
+    tank, as reinitialize_system() of the Chapter 4 notebooks.
+    """
+    lows = np.array([levels[0] + 1 for levels in system.tanks_level], dtype = np.float64)
+    highs = np.array([levels[-1] for levels in system.tanks_level], dtype = np.float64)
+    return(rng.random((size, system.n)) * (highs - lows) + lows)
+
+def random_fallback(batch, rng, rows):
+    return(batch.random_actions(rng, rows))
+
+def greedy_policy(Q, keys = 'int', fallback = random_fallback):
+    """
+    Greedy policy of a Q-table (QTable, BoundedQTable, ArrayQTable or qstore.MappedQTable): every copy of the
+    system takes Q.argmax() of its discrete state. keys tells how the table is indexed: 'int' for the codes of
+    System.state_to_int() / action_to_int(), 'str' for the strings of state_to_string() / action_to_string(), as
+    in the Chapter 4 notebooks. The copies whose state was never visited take the actions of
+    fallback(batch, rng, rows), by default BatchSystem.random_actions().
+
+    With an ArrayQTable the greedy actions of the whole batch are found with one array operation; with the other
+    tables Q.argmax() is called once per distinct state of the batch.
+    """
+    if keys not in ('int', 'str'):
+        raise ValueError("keys must be 'int' or 'str'")
+
+    def policy(batch, rng):
+        if isinstance(Q, ArrayQTable):
+            codes = batch.state_codes()
+            visited = Q.visited[codes]
+            best = np.argmax(np.where(visited, Q.values[codes], -np.inf), axis = 1)
+            actions = batch.int_to_actions(best)
+            unknown = ~visited.any(axis = 1)
+        else:
+            if keys == 'int':
+                states, inverse = np.unique(batch.state_codes(), return_inverse = True)
+            else:
+                digits = np.concatenate(batch.discrete_state(), axis = 1)
+                states, inverse = np.unique(digits, axis = 0, return_inverse = True)
+            actions = np.zeros((batch.batch_size, 2*batch.k), dtype = np.int64)
+            unknown = np.zeros(batch.batch_size, dtype = bool)
+            for i, state in enumerate(states):
+                rows = inverse.ravel() == i
+                if keys == 'int':
+                    action = Q.argmax(int(state))
+                else:
+                    action = Q.argmax(''.join(str(digit) for digit in state))
+                if action is None:
+                    unknown[rows] = True
+                elif keys == 'int':
+                    actions[rows] = batch.int_to_actions(action)
+                else:
+                    actions[rows] = [int(digit) for digit in action]
+
+        rows = np.flatnonzero(unknown)
+        if len(rows) > 0:
+            actions[rows] = fallback(batch, rng, rows)
+        return(actions)
+
+    return(policy)
+
+def movement_policy(choose, delivery_indices = None):
+    """
+    Policy that only chooses where the trucks go, as the policy gradient and imitation learning models do.
+    choose(tank_loads, rng) gets the tank loads of the batch, shape (batch_size, n), and returns either the
+    integer joint movements of utils_pg.action_to_int() (shape (batch_size,)) or the positions of the trucks
+    (shape (batch_size, k)). Every truck that goes to a tank delivers its load level delivery_indices[i]
+    (by default its largest level, i.e. its whole load).
+    """
+    def policy(batch, rng):
+        movements = np.asarray(choose(batch.tank_loads.copy(), rng), dtype = np.int64)
+        if movements.ndim == 1:
+            strides = (batch.n+1) ** np.arange(batch.k-1, -1, -1, dtype = np.int64)
+            movements = (movements[:, None] // strides) % (batch.n+1)
+        indices = batch.truck_n_levels - 1 if delivery_indices is None else delivery_indices
+        actions = np.empty((batch.batch_size, 2*batch.k), dtype = np.int64)
+        actions[:, :batch.k] = movements
+        actions[:, batch.k:] = indices
+        return(actions)
+
+    return(policy)
+
+def summarize(episodes, quantiles = QUANTILES):
+    """
+    Returns {statistic: {'mean', 'std', 'min', 'max', 'quantiles'}} for a dictionary of per-episode arrays,
+    where 'quantiles' is the array of the given quantiles.
+    """
+    summary = {}
+    for name, values in episodes.items():
+        summary[name] = {'mean': float(np.mean(values)), 'std': float(np.std(values)),
+                         'min': float(np.min(values)), 'max': float(np.max(values)),
+                         'quantiles': np.quantile(values, quantiles)}
+    return(summary)
+
+def evaluate(system, policy, n_episodes, episode_length, batch_size = 1024, seed = None, initial_loads = None,
+             discount_rate = 1.0, quantiles = QUANTILES, reset_trucks = True, use_kernel = kernels.HAVE_NUMBA):
+    """
+    Simulates n_episodes episodes of episode_length steps of the policy, batch_size of them at a time, and returns
+    a dictionary with:
+
+        'episodes': {statistic: array of shape (n_episodes,)} for the statistics of EPISODE_STATISTICS, summed
+                    over every episode: rewards (discounted by discount_rate), transport_rewards, level_rewards,
+                    trucks_not_deliverying (trucks that did not deliver because the tank would overflow),
+                    stockouts (empty tanks after each step, as System.number_of_tanks_empty()) and trucks_sent
+                    (trucks that went to a tank);
+        'step_rewards': mean reward of the episodes at every step, shape (episode_length,);
+        'summary': summarize(episodes, quantiles);
+        'quantiles': the quantiles of the summary.
+
+    Every episode starts with the trucks at the depot, the truck loads of system and the tank loads
+    initial_loads[episode] (an array of shape (n_episodes, n)), drawn by initial_tank_loads() by default.
+    With reset_trucks (the default) the trucks go back to the depot and are refilled after every step, as in the
+    train and test loops of the Chapter 4 notebooks; otherwise they stay where they are. A ValueError is raised
+    if some edge allowed by the graph has a non-finite transport weight. The results only depend on seed and
+    batch_size; system is not modified.
+    """
+    if not np.isfinite(system.weights_array[system.feasible_mask]).all():
+        raise ValueError('the transport weights of the edges allowed by the graph must be finite')
+    n_batches = -(-n_episodes // batch_size)
+    root = np.random.SeedSequence(seed)
+    loads_seed, *batch_seeds = root.spawn(1 + n_batches)
+    if initial_loads is None:
+        initial_loads = initial_tank_loads(system, np.random.default_rng(loads_seed), n_episodes)
+    initial_loads = np.asarray(initial_loads, dtype = np.float64)
+    if initial_loads.shape != (n_episodes, system.n):
+        raise ValueError('initial_loads must have shape (n_episodes, n)')
+
+    episodes = {name: np.zeros(n_episodes) for name in EPISODE_STATISTICS}
+    step_rewards = np.zeros(episode_length)
+
+    for b, batch_seed in enumerate(batch_seeds):
+        start = b * batch_size
+        stop = min(start + batch_size, n_episodes)
+        noise_seed, policy_seed = batch_seed.spawn(2)
+        rng = np.random.default_rng(policy_seed)
+        batch = BatchSystem(system, stop - start, seed = noise_seed, use_kernel = use_kernel)
+        batch.tank_loads[:] = initial_loads[start:stop]
+        batch.reset_trucks_positions()
+
+        rewards = episodes['rewards'][start:stop]
+        transport_rewards = episodes['transport_rewards'][start:stop]
+        level_rewards = episodes['level_rewards'][start:stop]
+        trucks_not_deliverying = episodes['trucks_not_deliverying'][start:stop]
+        stockouts = episodes['stockouts'][start:stop]
+        trucks_sent = episodes['trucks_sent'][start:stop]
+        discount = 1.0
+        for t in range(episode_length):
+            step = batch.step(policy(batch, rng))
+            rewards += discount * step[0]
+            transport_rewards += step[1]
+            level_rewards += step[2]
+            trucks_not_deliverying += step[3]
+            stockouts += batch.number_of_tanks_empty()
+            trucks_sent += np.count_nonzero(batch.positions != batch.n, axis = 1)
+            step_rewards[t] += np.sum(step[0])
+            discount = discount * discount_rate
+            if reset_trucks:
+                batch.reset_trucks_positions()
+                batch.reset_trucks_loads()
+
+    return({'episodes': episodes, 'step_rewards': step_rewards / n_episodes,
+            'summary': summarize(episodes, quantiles), 'quantiles': np.asarray(quantiles)})
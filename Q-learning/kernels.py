@@ -0,0 +1,192 @@
+"""
+Compiled transition kernel for stepping one or many systems (System.deterministic_action() and
+BatchSystem.step()).
+
+The movement, delivery, consumption and level rewards of all the copies of a system are done in plain loops,
+compiled with Numba when it is installed (HAVE_NUMBA) and run as ordinary Python otherwise. Every value is
+computed with the same floating point operations as the reference implementations, except the exponentials and
+the sums over the tanks, which are left to NumPy (np.exp and np.sum may round differently from their compiled
+counterparts), so the results are bit-identical to System.deterministic_action() and BatchSystem.step().
+"""
+import numpy as np
+
+import config
+
+try:
+    from numba import njit
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return(args[0])
+        return(lambda function: function)
+
+
+@njit(cache = True)
+def move_and_deliver(tank_loads, truck_loads, truck_positions, actions, weights, truck_levels, tank_max_loads,
+                     w_t, deliveries, delivery_indices, trucks_not_deliverying):
+    """
+    Moves the trucks of every copy b of the system to actions[b, :k] and delivers truck_levels[i, actions[b, k+i]]
+    from every truck i that is at a tank, if it fits in the tank (trucks are processed in order), as
+    System.deterministic_action(). Fills w_t (integer transport weights), deliveries, delivery_indices and
+    trucks_not_deliverying, and updates the loads and positions in place.
+    """
+    batch_size, k = truck_positions.shape
+    n = tank_loads.shape[1]
+    for b in range(batch_size):
+        trucks_not_deliverying[b] = 0
+        for i in range(k):
+            new_position = actions[b, i]
+            w_t[b, i] = np.int64(weights[truck_positions[b, i], new_position])
+            truck_positions[b, i] = new_position
+
+        for i in range(k):
+            position = actions[b, i]
+            if position != n:
+                index = actions[b, k + i]
+                delivery_quantity = truck_levels[i, index]
+                truck_loads[b, i] = truck_loads[b, i] - delivery_quantity
+                hipothetic_next_load = tank_loads[b, position] + delivery_quantity
+                if hipothetic_next_load <= tank_max_loads[position]:
+                    tank_loads[b, position] = hipothetic_next_load
+                else:
+                    trucks_not_deliverying[b] = trucks_not_deliverying[b] + 1
+            else:
+                index = 0
+                delivery_quantity = 0.0
+            delivery_indices[b, i] = index
+            deliveries[b, i] = delivery_quantity
+
+@njit(cache = True)
+def consume(tank_loads, tank_rates, tank_stochastic, noise):
+    """
+    Consumption of all the tanks of every copy of the system, as Tank.consume(); noise has the shape of
+    tank_loads (uniform in [-1, 1]) and is only used for the stochastic tanks.
+    """
+    batch_size, n = tank_loads.shape
+    for b in range(batch_size):
+        for j in range(n):
+            rate = tank_rates[j]
+            if tank_stochastic[j]:
+                rate = rate + rate * 0.10 * noise[b, j]
+            load = tank_loads[b, j] - rate
+            tank_loads[b, j] = load if load > 0 else 0.0
+
+@njit(cache = True, error_model = 'numpy')
+def level_reward_terms(loads, C_max, breakpoints, coefficients, P1, P2, M, R, exponential, exp_factors, exp_args):
+    """
+    Piecewise level reward rewards.R_lvl() of every tank of every copy of the system, written to R, except for
+    the loads in the exponential pieces, which are flagged in exponential and whose reward is
+    exp_factors * np.exp(exp_args) (see R_levels()).
+    """
+    batch_size, n = loads.shape
+    for b in range(batch_size):
+        for j in range(n):
+            x = loads[b, j] / C_max[j]
+            a = breakpoints[j, 0]
+            bb = breakpoints[j, 1]
+            c = breakpoints[j, 2]
+            d = breakpoints[j, 3]
+            e = breakpoints[j, 4]
+            f = breakpoints[j, 5]
+            exponential[b, j] = False
+            exp_factors[b, j] = 0.0
+            exp_args[b, j] = 0.0
+            if x < a:
+                R[b, j] = P2
+            elif x < bb:
+                exponential[b, j] = True
+                exp_factors[b, j] = -coefficients[j, 0]
+                exp_args[b, j] = coefficients[j, 1] / x
+            elif x < c:
+                R[b, j] = -P1*(x-c)/(c-bb)
+            elif x < d:
+                R[b, j] = M*(x-c)/(d-c)
+            elif x < e:
+                R[b, j] = M*(x-e)/(d-e)
+            elif x < f:
+                exponential[b, j] = True
+                exp_factors[b, j] = -coefficients[j, 2]
+                exp_args[b, j] = coefficients[j, 3] / (1-x)
+            else:
+                R[b, j] = P2
+
+def R_levels(loads, C_max, breakpoints, coefficients, P1 = None, P2 = None, M = None):
+    """
+    Same as rewards.R_levels() for loads of shape (batch, n), given the (n, 4) coefficients returned by
+    rewards.level_exp_coefficients(breakpoints, P1, P2). Returns an array of shape (batch,).
+    P1, P2 and M default to P1_GLOBAL, P2_GLOBAL and M_GLOBAL.
+    """
+    P1 = config.P1_GLOBAL if P1 is None else P1
+    P2 = config.P2_GLOBAL if P2 is None else P2
+    M = config.M_GLOBAL if M is None else M
+    R = np.empty(loads.shape)
+    exponential = np.empty(loads.shape, dtype = bool)
+    exp_factors = np.empty(loads.shape)
+    exp_args = np.empty(loads.shape)
+    level_reward_terms(loads, C_max, breakpoints, coefficients, float(P1), float(P2), float(M),
+                       R, exponential, exp_factors, exp_args)
+    with np.errstate(over = 'ignore', invalid = 'ignore'):
+        R = np.where(exponential, exp_factors * np.exp(exp_args), R)
+    return(np.sum(R, axis = -1))
+
+
+def check_actions(actions, n, k, n_levels):
+    """
+    Raises ValueError if some position is not in 0,...,n or some delivery index of a truck at a tank is not a
+    valid load level (the compiled kernel does not check bounds).
+    """
+    positions = actions[:, :k]
+    if np.any(positions < 0) or np.any(positions > n):
+        raise ValueError('truck positions must be in 0,...,n')
+    indices = actions[:, k:]
+    if np.any(((indices < 0) | (indices >= n_levels)) & (positions != n)):
+        raise ValueError('delivery index out of range of the truck load levels')
+
+def check_weights(weights, truck_positions, actions):
+    """
+    Raises OverflowError if some truck of actions (shape (batch, 2k)) moves along an edge with a non-finite
+    weight (a missing edge of the graph), as System.transport_weights(); the kernel would cast it silently.
+    """
+    k = truck_positions.shape[1]
+    if not np.isfinite(weights[truck_positions, actions[:, :k]]).all():
+        raise OverflowError('transport weight is not finite (move along a missing edge of the graph)')
+
+def deterministic_action(system, action):
+    """
+    Same as system.deterministic_action(action) (same state changes, system.da, system.a and returned rewards),
+    with the movement and delivery done by the kernel.
+    """
+    n, k = system.n, system.k
+    actions = np.asarray(action, dtype = np.int64).reshape(1, 2*k)
+    check_actions(actions, n, k, np.count_nonzero(np.isfinite(system.trucks_level_table), axis = 1))
+    check_weights(system.weights_array, system.truck_position_array[None, :], actions)
+
+    w_t = np.zeros((1, k), dtype = np.int64)
+    deliveries = np.zeros((1, k), dtype = np.float64)
+    delivery_indices = np.zeros((1, k), dtype = np.int64)
+    trucks_not_deliverying = np.zeros(1, dtype = np.int64)
+    move_and_deliver(system.tank_load_array[None, :], system.truck_load_array[None, :],
+                     system.truck_position_array[None, :], actions, system.weights_array,
+                     system.trucks_level_table, system.tanks_max_load_array,
+                     w_t, deliveries, delivery_indices, trucks_not_deliverying)
+    system.all_trucks_dirty = True
+    system.mark_dirty(tanks = actions[0, :k][actions[0, :k] != n])
+    system.consume()
+
+    new_positions = actions[0, :k].tolist()
+    system.da = [new_positions, delivery_indices[0].tolist()]
+    system.a = [new_positions, deliveries[0].tolist()]
+
+    trucks_not_deliverying = int(trucks_not_deliverying[0])
+
+    transport_rewards = config.C_TRANSPORT * system.R_transport(config.COEFF, w_t[0], deliveries[0])
+    level_rewards = config.C_LEVELS * R_levels(system.tank_load_array[None, :], system.tanks_max_load_array,
+                                        system.level_breakpoints, system.level_coefficients)[0]
+    extra_rewards = config.C_LEVELS * trucks_not_deliverying * config.NOT_DELIVERYING_PENALTY
+
+    rewards = level_rewards - transport_rewards + extra_rewards
+
+    return(rewards, transport_rewards, level_rewards, trucks_not_deliverying)
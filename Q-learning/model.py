@@ -1,51 +1,115 @@
 import numpy as np
-import math
 #import networkx as nx
 import random
 
-import matplotlib.pyplot as plt
-from tank import Tank
+from tank import Tank, padded_levels, LevelIndex
 from truck import Truck
-import copy
+import rewards as rw
+from profiling import PhaseTimer
 
+# Reward constants (COEFF, C_TRANSPORT, ...), read from gym_pdsystem only when first used; matplotlib is only
+# imported by visualize() and visualize_step()
+import config
 
-import gym_pdsystem.utils.utilsq as ut
-import gym_pdsystem.utils.constants as ct
-import gym_pdsystem.utils.functions as fnc
 
+def __getattr__(name):
+    # the reward constants (model.COEFF, ...) are read from config when first used
+    if name in config.NAMES:
+        return(getattr(config, name))
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
 
-COEFF = ct.COEFF
 
-C_TRANSPORT = ct.C_TRANSPORT
-C_LEVELS = ct.C_LEVELS
+def mixed_radix_strides(radices):
+    """
+    Returns the place values of a mixed-radix number system with the given radices (the first digit is the
+    most significant one). Python integers are used, so the codes never overflow.
+    """
+    strides = [1] * len(radices)
+    for i in reversed(range(len(radices)-1)):
+        strides[i] = strides[i+1] * int(radices[i+1])
+    return(strides)
 
-p0_GLOBAL = ct.p0_GLOBAL
+def mixed_radix_encode(digits, radices, strides):
+    """
+    Encodes a sequence of digits (digit i in range(radices[i])) as a single integer.
+    """
+    code = 0
+    for digit, radix, stride in zip(digits, radices, strides):
+        digit = int(digit)
+        if digit < 0 or digit >= radix:
+            raise ValueError('digit {} out of range for radix {}'.format(digit, radix))
+        code = code + digit * stride
+    return(code)
 
-P1_GLOBAL = ct.P1_GLOBAL
-P2_GLOBAL = ct.P2_GLOBAL
-
-M_GLOBAL = ct.M_GLOBAL
-
-NOT_DELIVERYING_PENALTY = ct.NOT_DELIVERYING_PENALTY #to be equivalent/same importance as having 0 stock or surpassing max capacity levels
+def mixed_radix_decode(code, radices):
+    """
+    Inverse of mixed_radix_encode(): returns the list of digits encoded by the integer code.
+    """
+    code = int(code)
+    digits = [0] * len(radices)
+    for i in reversed(range(len(radices))):
+        code, digits[i] = divmod(code, int(radices[i]))
+    if code != 0:
+        raise ValueError('code out of range for the given radices')
+    return(digits)
 
     
 class System():
-    def __init__(self, tanks, trucks, adjacency_matrix, weights_matrix):
+    def __init__(self, tanks, trucks, adjacency_matrix, weights_matrix, seed = None):
         self.tanks = tanks
         self.trucks = trucks
         self.graph = adjacency_matrix
         self.weights = weights_matrix
+        self.weights_array = np.ascontiguousarray(weights_matrix, dtype = np.float64)
+        # Feasible moves from each position (tanks 0,...,n-1 and the depot n) according to the graph
+        self.feasible_mask = np.asarray(self.graph) == 1
+        self.feasible_moves = [np.flatnonzero(row) for row in self.feasible_mask]
         self.k = len(trucks)
         self.n = len(tanks)
-        self.s = self.state()
-        self.ds = self.discrete_state()
+
+        # Loads and positions of all the tanks and trucks, stored contiguously (tanks and trucks are views over them)
+        self.tank_load_array = np.empty(self.n, dtype = np.float64)
+        self.truck_load_array = np.empty(self.k, dtype = np.float64)
+        self.truck_position_array = np.empty(self.k, dtype = np.int64)
+        # Indices of the tanks and trucks modified since the last update_state() (see mark_dirty())
+        self.dirty_tanks = set()
+        self.dirty_trucks = set()
+        self.all_tanks_dirty = True
+        self.all_trucks_dirty = True
+        for i, tank in enumerate(self.tanks):
+            tank.bind(self.tank_load_array, i, self.dirty_tanks)
+        for i, truck in enumerate(self.trucks):
+            truck.bind(self.truck_load_array, self.truck_position_array, i, self.dirty_trucks)
+
+        self.tanks_level_table = padded_levels(self.tank_levels())
+        # Load at or below which every tank leaves each of its levels (the level below), see consume()
+        self.tanks_lower_table = np.concatenate([np.full((self.n, 1), -np.inf), self.tanks_level_table[:, :-1]],
+                                                axis = 1)
+        self.tank_range = np.arange(self.n)
+        self.trucks_level_table = padded_levels(self.truck_levels())
+        self.tanks_level_index = LevelIndex(self.tanks_level_table)
+        self.trucks_level_index = LevelIndex(self.trucks_level_table)
+        self.tanks_rate_array = np.array(self.tank_rates(), dtype = np.float64)
+        self.tanks_stochastic = np.array([tank.stochastic for tank in self.tanks], dtype = bool)
+        self.n_stochastic = int(np.count_nonzero(self.tanks_stochastic))
+
+        # Random generators of the system (random_action() and stochastic consumption), see set_seed()
+        self.set_seed(seed)
         
         self.tanks_id = self.tank_ids()
         self.trucks_id = self.truck_ids()
         self.tanks_max_load = self.tank_max_loads()
         self.trucks_max_load = self.truck_max_loads()
+        self.trucks_max_load_array = np.array(self.trucks_max_load, dtype = np.float64)
         self.tanks_level = self.tank_levels()
         self.trucks_level = self.truck_levels()
+
+        # Per-tank breakpoints of the level rewards (see R_levels)
+        self.tanks_max_load_array = np.array(self.tanks_max_load, dtype = np.float64)
+        self.tanks_level_percentages = np.array([tank.level_percentages for tank in self.tanks], dtype = np.float64)
+        self.level_breakpoints = rw.level_breakpoints(self.tanks_level_percentages, config.p0_GLOBAL)
+        self.level_coefficients = rw.level_exp_coefficients(self.level_breakpoints, config.P1_GLOBAL,
+                                                            config.P2_GLOBAL)
         
         #
         self.actions_dim = (self.n+1) ** self.k
@@ -53,10 +117,39 @@ class System():
         self.state_length = 2*self.k + self.n
         self.action_length = 2*self.k
         self.state_action_length = self.state_length + self.action_length
+        self.snapshot_size = self.n + 2*self.k
+
+        # Mixed-radix integer encoding of the discrete states and actions
+        self.state_radices = self.state_radix_list()
+        self.action_radices = self.action_radix_list()
+        self.state_strides = mixed_radix_strides(self.state_radices)
+        self.action_strides = mixed_radix_strides(self.action_radices)
+        self.states_code_dim = self.state_strides[0] * self.state_radices[0]
+        self.actions_code_dim = self.action_strides[0] * self.action_radices[0]
+        self._joint_movements = None
+
+        # Optional PhaseTimer accumulating the time of each phase of the actions (see enable_profiling())
+        self.profiler = None
+
+        # Flattened discrete state and its integer code, kept up to date by update_state()
+        self.ds_digits = np.zeros(self.state_length, dtype = np.int64)
+        self.state_code = 0
+        self.update_state()
 
         #
         self.a = None
         self.da = None
+
+    def __setstate__(self, state):
+        """
+        Systems pickled before the loads and positions were stored in arrays (the system-sim*.pkl files of the
+        simulations) are rebuilt from their tanks, trucks, graph and weights, which binds the tanks and trucks to
+        new arrays and recomputes the derived attributes. Their random generators are seeded from the OS.
+        """
+        if 'tank_load_array' in state:
+            self.__dict__.update(state)
+        else:
+            self.__init__(state['tanks'], state['trucks'], state['graph'], state['weights'])
         
     def get_trucks(self):
             return(self.trucks)
@@ -80,14 +173,107 @@ class System():
         return(n_s)    
                
         
+    def state_radix_list(self):
+        """
+        Returns the number of values that each component of the (flattened) discrete state can take:
+        n+1 positions per truck, the number of load levels of each truck and of each tank.
+        """
+        radices = [self.n+1] * self.k
+        radices = radices + [len(truck.levels) for truck in self.trucks]
+        radices = radices + [len(tank.levels) for tank in self.tanks]
+        return(radices)
+
+    def action_radix_list(self):
+        """
+        Returns the number of values that each component of the (flattened) discrete action can take:
+        n+1 positions per truck and the number of delivery indices of each truck (random_action() indexes
+        the deliverable fractions, deterministic_action() the truck load levels).
+        """
+        radices = [self.n+1] * self.k
+        radices = radices + [max(len(truck.levels), len(truck.fractions)) for truck in self.trucks]
+        return(radices)
+
+    def joint_action_mask(self, positions = None, deliveries = False):
+        """
+        Returns a boolean mask over the (n+1)^k joint movements of the trucks (encoded with the first truck as the
+        most significant digit, as utils_pg.action_to_int) telling which ones are allowed by the graph from the
+        given truck positions (by default, the current ones).
+
+        positions can also be an array of shape (batch, k), in which case the masks have shape (batch, (n+1)^k).
+        With deliveries = True every movement is repeated for all the delivery indices, so that the mask is
+        indexed by the action codes of action_to_int() (length self.actions_code_dim).
+        """
+        if positions is None:
+            positions = self.truck_positions()
+        rows = self.feasible_mask[np.asarray(positions, dtype = np.int64)]
+
+        mask = rows[..., 0, :]
+        for i in range(1, self.k):
+            mask = mask[..., :, None] & rows[..., i, None, :]
+            mask = mask.reshape(mask.shape[:-2] + (-1,))
+
+        if deliveries:
+            mask = np.repeat(mask, self.actions_code_dim // (self.n+1)**self.k, axis = -1)
+        return(mask)
+
+    def joint_movements(self, max_actions = 10**7):
+        """
+        Returns the ((n+1)^k, k) array of all the joint movements of the trucks, in the order of
+        joint_action_mask() (row j holds the digits of j in base n+1, first truck most significant).
+        It is computed once; a ValueError is raised if there are more than max_actions of them.
+        """
+        if self._joint_movements is None:
+            n_actions = (self.n+1) ** self.k
+            if n_actions > max_actions:
+                raise ValueError('{} joint movements exceed max_actions = {}'.format(n_actions, max_actions))
+            strides = (self.n+1) ** np.arange(self.k-1, -1, -1, dtype = np.int64)
+            self._joint_movements = (np.arange(n_actions, dtype = np.int64)[:, None] // strides) % (self.n+1)
+        return(self._joint_movements)
+
+    def transport_weights(self, new_positions, old_positions = None):
+        """
+        Returns the transport weights weights[old, new] of every truck as integers (truncated, as in
+        deterministic_action()), gathered in one call. new_positions can have shape (k,) or (..., k), e.g. a batch
+        of actions or joint_movements(); old_positions (by default the current positions) is broadcast with it.
+        An OverflowError is raised if some weight is not finite (a move along a missing edge of the graph).
+        """
+        if old_positions is None:
+            old_positions = self.truck_position_array
+        w = self.weights_array[old_positions, new_positions]
+        if not np.isfinite(w).all():
+            raise OverflowError('transport weight is not finite (move along a missing edge of the graph)')
+        return(w.astype(np.int64))
+
+    def joint_transport_costs(self, delivery_indices = None, positions = None, coeff = None):
+        """
+        Returns the transport cost R_transport(coeff, w, u) of each of the (n+1)^k joint movements of
+        joint_movements() from the given truck positions (by default the current ones), as an array of shape
+        ((n+1)^k,), where every truck that goes to a tank delivers its load level delivery_indices[i] (by
+        default its largest level) and the trucks that go to the depot deliver nothing. coeff defaults to COEFF.
+        The movements along a missing edge of the graph (non-finite weight) cost inf.
+        """
+        if coeff is None:
+            coeff = config.COEFF
+        movements = self.joint_movements()
+        if delivery_indices is None:
+            delivery_indices = [len(truck.levels) - 1 for truck in self.trucks]
+        quantities = np.array([truck.levels[index] for truck, index in zip(self.trucks, delivery_indices)])
+        if positions is None:
+            positions = self.truck_position_array
+        w = self.weights_array[np.asarray(positions, dtype = np.int64), movements]
+        finite = np.isfinite(w).all(axis = -1)
+        w = np.trunc(np.where(np.isfinite(w), w, 0.0))
+        u = np.where(movements != self.n, quantities, 0.0)
+        return(np.where(finite, self.R_transport(coeff, w, u), np.inf))
+
     def truck_loads(self):
-        return([self.trucks[i].load for i in range(self.k)])
+        return(self.truck_load_array.tolist())
     
     def truck_max_loads(self):
         return([self.trucks[i].max_load for i in range(self.k)])
     
     def truck_positions(self):
-        return([self.trucks[i].pos for i in range(self.k)])
+        return(self.truck_position_array.tolist())
     
     def truck_ids(self):
         return([self.trucks[i].id for i in range(self.k)])
@@ -99,7 +285,7 @@ class System():
     
     
     def tank_loads(self):
-        return([self.tanks[i].load for i in range(self.n)])
+        return(self.tank_load_array.tolist())
     
     def tank_max_loads(self):
         return([self.tanks[i].max_load for i in range(self.n)])
@@ -120,22 +306,45 @@ class System():
         """
         s = [self.truck_positions(), self.truck_loads(), self.tank_loads()]
         return(s)
+
+    @property
+    def s(self):
+        """
+        Current (continuous) state of the system, state(), built when it is read
+        """
+        return(self.state())
+
+    @property
+    def ds(self):
+        """
+        Discrete state of the system as of the last update_state() (truck positions, truck load levels and tank
+        load levels), built from self.ds_digits when it is read
+        """
+        k = self.k
+        return([self.ds_digits[:k].tolist(), self.ds_digits[k:2*k].tolist(), self.ds_digits[2*k:].tolist()])
     
+    def state_view(self):
+        """
+        Returns the current (continuous) state of the system as views (not copies) of the arrays of truck positions,
+        truck loads and tank loads. Note that they change as the system evolves.
+        """
+        return([self.truck_position_array, self.truck_load_array, self.tank_load_array])
+
     def discrete_state(self):
         """
         Returns the current discretized state version of the system
         """
         ds = [ [],[] ,[] ]
         ds[0] = self.s[0]
-        
-        for i, truck in enumerate(self.trucks):
-            ds[1].append(truck.load_to_lvl())
-            
-            
-        for i, tank in enumerate(self.tanks):
-            ds[2].append(tank.load_to_lvl())
-            
+        ds[1] = self.trucks_level_index.lvls(self.truck_load_array).tolist()
+        ds[2] = self.tanks_level_index.lvls(self.tank_load_array).tolist()
         return(ds)    
+
+    def tank_lvls(self):
+        """
+        Returns the discrete levels of the current loads of all the tanks, as an array of shape (n,)
+        """
+        return(self.tanks_level_index.lvls(self.tank_load_array))
             
     def set_discrete_state(self, d_state):
         """
@@ -151,17 +360,159 @@ class System():
         for i in d_state[2*self.k:]:
             ds[2].append(int(i))
             
-        self.ds = ds  
-        
+        self.ds_digits[:] = ds[0] + ds[1] + ds[2]
+        self.state_code = mixed_radix_encode(self.ds_digits.tolist(), self.state_radices, self.state_strides)
+        # the next update_state() recomputes the discrete state from the actual loads and positions
+        self.mark_dirty()
         
+    def mark_dirty(self, tanks = None, trucks = None):
+        """
+        Marks the given tanks and trucks (an index, or a list or array of indices) as modified, so that the next
+        update_state() recomputes their discrete levels. Without arguments all of them are marked. Changes made
+        through tank.load, truck.load and truck.pos are tracked automatically; this is only needed after writing
+        to the arrays of state_view().
+        """
+        if tanks is None and trucks is None:
+            self.all_tanks_dirty = True
+            self.all_trucks_dirty = True
+        if tanks is not None:
+            self.dirty_tanks.update(np.atleast_1d(tanks).tolist())
+        if trucks is not None:
+            self.dirty_trucks.update(np.atleast_1d(trucks).tolist())
+
     def update_state(self):
         """
         Update both the discretized and contiuous state of the system (just in case some tank or truck levels,
-        truck positions, etc. have been modified/updated)
+        truck positions, etc. have been modified/updated).
+
+        Only the tanks and trucks modified since the last update (see mark_dirty()) are discretized again, and
+        the integer code of the state (state_to_int()) is updated with the digits that have changed, so the cost
+        depends on the number of trucks and of changed tanks, not on n. self.s and self.ds are built from the
+        arrays when they are read.
         """
-        self.s = self.state()
-        self.ds = self.discrete_state()
+        profiler = self.profiler
+        if profiler is not None: start = profiler.start()
+        n, k = self.n, self.k
+        digits = self.ds_digits
+        changes = []
+        if self.all_trucks_dirty:
+            changes.append((np.arange(k), self.truck_position_array))
+            changes.append((k + np.arange(k), self.trucks_level_index.lvls(self.truck_load_array)))
+        elif self.dirty_trucks:
+            trucks = np.fromiter(self.dirty_trucks, dtype = np.int64, count = len(self.dirty_trucks))
+            changes.append((trucks, self.truck_position_array[trucks]))
+            changes.append((k + trucks, self.trucks_level_index.lvls(self.truck_load_array[trucks], trucks)))
+        if self.all_tanks_dirty:
+            changes.append((2*k + np.arange(n), self.tanks_level_index.lvls(self.tank_load_array)))
+        elif self.dirty_tanks:
+            tanks = np.fromiter(self.dirty_tanks, dtype = np.int64, count = len(self.dirty_tanks))
+            changes.append((2*k + tanks, self.tanks_level_index.lvls(self.tank_load_array[tanks], tanks)))
+
+        for index, new_digits in changes:
+            old_digits = digits[index]
+            for j in np.flatnonzero(new_digits != old_digits):
+                self.state_code += (int(new_digits[j]) - int(old_digits[j])) * self.state_strides[index[j]]
+            digits[index] = new_digits
+        self.dirty_tanks.clear()
+        self.dirty_trucks.clear()
+        self.all_tanks_dirty = False
+        self.all_trucks_dirty = False
+        if profiler is not None: profiler.lap('update_state', start)
+
+    def enable_profiling(self, profiler = None):
+        """
+        Starts accumulating the time and number of calls of each phase of random_action() and
+        deterministic_action() (movement, delivery, consumption, encoding, R_transport, R_levels) and of
+        update_state() in profiler (a new profiling.PhaseTimer by default), which is returned. Export it with
+        profiler.as_dict() or profiler.to_csv() at the end of an episode.
+        """
+        self.profiler = PhaseTimer() if profiler is None else profiler
+        return(self.profiler)
+
+    def disable_profiling(self):
+        """
+        Stops the profiling and returns the PhaseTimer that was in use (or None)
+        """
+        profiler = self.profiler
+        self.profiler = None
+        return(profiler)
         
+    def snapshot(self, out = None):
+        """
+        Copies the mutable state of the system (tank loads, truck loads and truck positions, in this order) into
+        the preallocated array out of length self.snapshot_size (a new array is created if out is None) and
+        returns it. Together with restore() it allows to branch the simulation (e.g. to try several actions from
+        the current state) without copy.deepcopy().
+
+        The random generators (self.rng, self.noise_rng and the pregenerated noise) are not part of the snapshot:
+        to replay the random actions or the consumption of stochastic tanks, save snapshot_rng() as well and pass
+        it to restore().
+        """
+        if out is None:
+            out = np.empty(self.snapshot_size)
+        n, k = self.n, self.k
+        out[:n] = self.tank_load_array
+        out[n:n+k] = self.truck_load_array
+        out[n+k:] = self.truck_position_array
+        return(out)
+
+    def restore(self, snapshot, rng_state = None):
+        """
+        Sets the tank loads, truck loads and truck positions to the ones saved by snapshot() and updates the state.
+        If rng_state (saved by snapshot_rng()) is given, the random generators are restored too.
+        """
+        n, k = self.n, self.k
+        self.tank_load_array[:] = snapshot[:n]
+        self.truck_load_array[:] = snapshot[n:n+k]
+        self.truck_position_array[:] = snapshot[n+k:]
+        if rng_state is not None:
+            self.restore_rng(rng_state)
+        self.mark_dirty()
+        self.update_state()
+
+    def set_seed(self, seed = None):
+        """
+        Replaces the random generators of the system: self.rng (random_action()) and self.noise_rng (consumption
+        noise of the stochastic tanks), two independent streams spawned from numpy.random.SeedSequence(seed).
+        seed can also be a SeedSequence (e.g. one spawned per worker). Any pregenerated noise is dropped.
+        """
+        if not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+        action_seed, noise_seed = seed.spawn(2)
+        self.rng = np.random.default_rng(action_seed)
+        self.noise_rng = np.random.default_rng(noise_seed)
+        self.noise_table = None
+        self.noise_step = 0
+
+    def pregenerate_noise(self, steps):
+        """
+        Draws the consumption noise of the stochastic tanks for the next steps calls of consume() as one
+        (steps, number of stochastic tanks) array, which consume() then reads row by row before drawing again from
+        self.noise_rng. The results are the same as without pregenerating it. Returns the table.
+        """
+        self.noise_table = self.noise_rng.uniform(-1, 1, size = (steps, self.n_stochastic))
+        self.noise_step = 0
+        return(self.noise_table)
+
+    def snapshot_rng(self):
+        """
+        Returns the state of the random generator of the system (and its pregenerated noise), together with the
+        ones of Python's random module and the global NumPy generator used by the training loops, to be passed to
+        restore_rng().
+        """
+        noise_table = None if self.noise_table is None else self.noise_table.copy()
+        return({'system': self.rng.bit_generator.state, 'noise': self.noise_rng.bit_generator.state,
+                'noise_table': noise_table, 'noise_step': self.noise_step,
+                'random': random.getstate(), 'numpy': np.random.get_state()})
+
+    def restore_rng(self, rng_state):
+        self.rng.bit_generator.state = rng_state['system']
+        self.noise_rng.bit_generator.state = rng_state['noise']
+        self.noise_table = None if rng_state['noise_table'] is None else rng_state['noise_table'].copy()
+        self.noise_step = rng_state['noise_step']
+        random.setstate(rng_state['random'])
+        np.random.set_state(rng_state['numpy'])
+
     def state_to_string(self):
         """
         Returns a string that encodes the current discrete state of the system
@@ -191,10 +542,43 @@ class System():
             
         return(sa_str)
             
+    def state_to_int(self):
+        """
+        Returns an integer in range(self.states_code_dim) that encodes the current discrete state of the system
+        (maintained by update_state() and set_discrete_state())
+        """
+        return(self.state_code)
+
+    def int_to_state(self, code):
+        """
+        Returns the flattened discrete state encoded by state_to_int() (as accepted by set_discrete_state())
+        """
+        return(mixed_radix_decode(code, self.state_radices))
+
+    def action_to_int(self):
+        """
+        Returns an integer in range(self.actions_code_dim) that encodes the current discrete action taken by the system
+        """
+        digits = self.da[0] + self.da[1]
+        return(mixed_radix_encode(digits, self.action_radices, self.action_strides))
+
+    def int_to_action(self, code):
+        """
+        Returns the flattened discrete action encoded by action_to_int() (as accepted by deterministic_action())
+        """
+        return(mixed_radix_decode(code, self.action_radices))
+
+    def state_action_to_int(self):
+        """
+        Returns an integer that encodes the current discrete state-action of the system
+        """
+        return(self.state_to_int() * self.actions_code_dim + self.action_to_int())
+
     def visualize(self, show = False):
             """
             TO DO
             """
+            import matplotlib.pyplot as plt
             index = np.arange(self.n)
             tanks_max_load = self.tanks_max_load
             tank_loads = self.tank_loads()
@@ -215,6 +599,7 @@ class System():
             """
             TO DO
             """
+            import matplotlib.pyplot as plt
             index, tanks_max_load, tank_loads, tanks_id = args;
             plt.bar(index, tanks_max_load, color = 'black')
             plt.bar(index, tank_loads, color = 'blue' )
@@ -265,37 +650,60 @@ class System():
   
     
     def reset_trucks_positions(self):
-        for truck in self.trucks:
-            truck.pos = self.n
+        self.truck_position_array[:] = self.n
+        self.all_trucks_dirty = True
             
     def reset_trucks_loads(self):
-        for truck in self.trucks:
-            truck.load = truck.max_load  
+        self.truck_load_array[:] = self.trucks_max_load_array
+        self.all_trucks_dirty = True
+
+    def consume(self):
+        """
+        Updates the loads of all the tanks according to their consumption rates (as Tank.consume()) in one vector
+        operation. The noise of the stochastic tanks is drawn as one array from self.noise_rng, or taken from the
+        pregenerated noise table. Only the tanks whose discrete level changes are marked as modified.
+        """
+        rates = self.tanks_rate_array
+        if self.n_stochastic > 0:
+            if self.noise_table is not None and self.noise_step < len(self.noise_table):
+                draws = self.noise_table[self.noise_step]
+                self.noise_step = self.noise_step + 1
+            else:
+                draws = self.noise_rng.uniform(-1, 1, size = self.n_stochastic)
+            noise = np.zeros(self.n)
+            noise[self.tanks_stochastic] = draws
+            rates = np.where(self.tanks_stochastic, rates + rates * 0.10 * noise, rates)
+        np.maximum(0, self.tank_load_array - rates, out = self.tank_load_array)
+        if not self.all_tanks_dirty:
+            # loads only decrease, so a tank changes its level when its load reaches the level below
+            lvls = self.ds_digits[2*self.k:]
+            changed = self.tank_load_array <= self.tanks_lower_table[self.tank_range, lvls]
+            self.dirty_tanks.update(np.flatnonzero(changed).tolist())
             
     def R_transport(self, coeff, w, u):
-        return( coeff * np.sum(w*u) )
+        """
+        Transport cost coeff * sum_i w_i u_i of an action; w and u can also have shape (batch, k), in which case
+        the costs of the batch are returned.
+        """
+        return( coeff * np.sum(w*u, axis = -1) )
     
-    def R_levels(self, p0 = p0_GLOBAL, M = M_GLOBAL, P1 = P1_GLOBAL,  P2 = P2_GLOBAL): #STILL TO DECIDE THE DEFAULT VALUES 
-        
-        R = 0
-        
-        for i, tank in enumerate(self.tanks):
-            percentages = tank.level_percentages
-            b = percentages[0]
-            c = percentages[1]
-            e = percentages[2]
-            
-            a = b/10
-            f = 1-(1-e)/10
-            d = p0*e+(1-p0)*c
-            
-            C_max = tank.max_load
-            x = tank.load
-            
-            R = R + fnc.R_lvl(x, C_max, a,b,c,d,e,f,P1,P2,M)
-            
-            
-        return(R)  
+    def R_levels(self, p0 = None, M = None, P1 = None,  P2 = None): #STILL TO DECIDE THE DEFAULT VALUES 
+        """
+        Returns the sum of the level rewards of all the tanks, computed in one vectorized call
+        (the breakpoints a,...,f of each tank are precomputed for the default p0).
+        The parameters default to p0_GLOBAL, M_GLOBAL, P1_GLOBAL and P2_GLOBAL.
+        """
+        p0 = config.p0_GLOBAL if p0 is None else p0
+        M = config.M_GLOBAL if M is None else M
+        P1 = config.P1_GLOBAL if P1 is None else P1
+        P2 = config.P2_GLOBAL if P2 is None else P2
+        if p0 == config.p0_GLOBAL:
+            breakpoints = self.level_breakpoints
+        else:
+            breakpoints = rw.level_breakpoints(self.tanks_level_percentages, p0)
+
+        R = rw.R_levels(self.tank_load_array, self.tanks_max_load_array, breakpoints, P1, P2, M)
+        return(R)
             
     
     def random_action(self, seed = None, verbose = False):
@@ -303,16 +711,20 @@ class System():
         TO DO
         """
         #It is assumed that the current state of the system is updated.
+        profiler = self.profiler
+        if profiler is not None: start = profiler.start()
         
+        # The random choices are drawn from self.rng; seed only reseeds it, the consumption noise (self.noise_rng
+        # and any pregenerated noise) keeps its own stream
         if seed != None:
-            random.seed(seed)
+            self.rng = np.random.default_rng(seed)
             
             
         new_positions = [] 
         new_deliveries = []
         new_deliveries_index = []
         
-        w_t = np.full(self.k, 0)
+        old_positions = self.truck_position_array.copy()
         trucks_not_deliverying = 0
         
         rewards = 0  
@@ -323,20 +735,20 @@ class System():
         for i, truck in enumerate(self.get_trucks()):
             old_position = truck.pos
             if verbose: print("truck pos: ", old_position)
-            possible_positions_index = np.isin(self.graph[old_position], 1)
-            possible_positions = np.where(possible_positions_index)
-            #random.randint(0,len(possible_positions[0])-1)
-            if verbose: print("nº of possible positions", len(possible_positions_index))
-            new_position = random.randrange(len(possible_positions_index))
+            possible_positions = self.feasible_moves[old_position]
+            if verbose: print("nº of possible positions", len(possible_positions))
+            if len(possible_positions) == 0:
+                new_position = old_position
+            else:
+                new_position = int(possible_positions[self.rng.integers(len(possible_positions))])
             if verbose: print("new position: ",new_position)
             truck.pos = new_position
             if verbose: print("possible_positions:", possible_positions)
-            
-            # Update rewards due to oil costs (transport/km)
-            w_t[i] = self.weights[old_position][new_position]
             new_positions.append(new_position)
 
-            
+        # Update rewards due to oil costs (transport/km)
+        w_t = self.transport_weights(new_positions, old_positions)
+        if profiler is not None: start = profiler.lap('movement', start)
             
         # Choose a new (possible) load delivery for each truck to the new tank (position)
         # and update the tank's load after deliverying the chosen quantity.
@@ -362,7 +774,7 @@ class System():
                         trucks_not_deliverying = trucks_not_deliverying + 1 
                         
                     else:
-                        random_index = random.randint(0,len(possible_delivery_quantities)-1)
+                        random_index = int(self.rng.integers(len(possible_delivery_quantities)))
                         #delivery_quantity = np.random.choice(possible_delivery_quantities)
                         delivery_quantity = possible_delivery_quantities[random_index]
                         current_tank.load = current_tank.load + delivery_quantity
@@ -378,10 +790,11 @@ class System():
                 new_deliveries_index.append(random_index)
     
         u_t = np.asarray(new_deliveries)             
+        if profiler is not None: start = profiler.lap('delivery', start)
         
         # Update the loads of the tanks accordig to their consumption rates
-        for tank in self.tanks:           
-            tank.consume()
+        self.consume()
+        if profiler is not None: start = profiler.lap('consumption', start)
         
         
         self.da = [new_positions, new_deliveries_index]
@@ -389,11 +802,15 @@ class System():
         
         if len(self.action_to_string()) != self.action_length:
             print("ACTION WITH WRONG LENGTH")
+        if profiler is not None: start = profiler.lap('encoding', start)
             
-        transport_rewards = C_TRANSPORT * self.R_transport(COEFF, w_t, u_t)
-        level_rewards = C_LEVELS * self.R_levels()
+        transport_rewards = config.C_TRANSPORT * self.R_transport(config.COEFF, w_t, u_t)
+        if profiler is not None: start = profiler.lap('R_transport', start)
+        level_rewards = config.C_LEVELS * self.R_levels()
+        if profiler is not None: start = profiler.lap('R_levels', start)
         
-        rewards = level_rewards - transport_rewards + C_LEVELS *trucks_not_deliverying * NOT_DELIVERYING_PENALTY
+        rewards = level_rewards - transport_rewards + \
+                  config.C_LEVELS *trucks_not_deliverying * config.NOT_DELIVERYING_PENALTY
         
         return(rewards, transport_rewards, level_rewards, trucks_not_deliverying)
     
@@ -404,6 +821,8 @@ class System():
         """
         
         #It is assumed that the current state of the system is updated.
+        profiler = self.profiler
+        if profiler is not None: start = profiler.start()
 
         rewards = 0
         def action_to_int(action):
@@ -416,18 +835,17 @@ class System():
         new_deliveries = []
         new_deliveries_index = []
         
-        w_t = np.full(self.k, 0)
         trucks_not_deliverying = 0
 
         
         action = action_to_int(action)
         
+        w_t = self.transport_weights(action[0:self.k])
         for i, new_position in enumerate(action[0:self.k]):
-            old_position = self.trucks[i].pos
             self.trucks[i].pos = new_position
-            w_t[i] = self.weights[old_position][new_position]
             new_positions.append(new_position)
 
+        if profiler is not None: start = profiler.lap('movement', start)
      
         for new_delivery_index, truck in zip(action[self.k:], self.trucks):
             if truck.pos != self.n:
@@ -460,22 +878,26 @@ class System():
             new_deliveries.append(delivery_quantity)
 
         u_t = np.asarray(new_deliveries)             
+        if profiler is not None: start = profiler.lap('delivery', start)
 
         # Update the loads of the tanks accordig to their consumption rates
-        for tank in self.tanks:           
-            tank.consume()
+        self.consume()
+        if profiler is not None: start = profiler.lap('consumption', start)
         
         self.da = [new_positions, new_deliveries_index]
         self.a = [new_positions, new_deliveries]    
        
         if len(self.action_to_string()) != self.action_length:
             print("ACTION WITH WRONG LENGTH")
+        if profiler is not None: start = profiler.lap('encoding', start)
             
         #if verbose: print(self.da, self.a)
             
-        transport_rewards = C_TRANSPORT * self.R_transport(COEFF, w_t, u_t)
-        level_rewards = C_LEVELS * self.R_levels()
-        extra_rewards = C_LEVELS * trucks_not_deliverying * NOT_DELIVERYING_PENALTY
+        transport_rewards = config.C_TRANSPORT * self.R_transport(config.COEFF, w_t, u_t)
+        if profiler is not None: start = profiler.lap('R_transport', start)
+        level_rewards = config.C_LEVELS * self.R_levels()
+        if profiler is not None: start = profiler.lap('R_levels', start)
+        extra_rewards = config.C_LEVELS * trucks_not_deliverying * config.NOT_DELIVERYING_PENALTY
             
         rewards = level_rewards - transport_rewards + extra_rewards  
         
@@ -0,0 +1,158 @@
+"""
+Exhaustive one-step lookahead planner: a reference controller that, from the current state of a System, scores
+every joint action (truck positions and delivery levels) with the one-step reward of
+System.deterministic_action() and takes the best one.
+
+All the candidate actions are enumerated once, and their rewards are computed as one vectorized batch from the
+transport weights of the current positions and the tank loads that each candidate leads to, instead of copying
+the system and calling deterministic_action() (n+1)^k times:
+
+    planner = LookaheadPlanner(system)
+    action, reward = planner.plan()
+    system.deterministic_action(action)
+
+planner.policy can also be evaluated with evaluation.evaluate() or used as the expert of the imitation data.
+"""
+import numpy as np
+
+import rewards as rw
+import config
+
+
+class LookaheadPlanner():
+    """
+    One-step lookahead over all the joint actions of system. The candidates are the (n+1)^k joint movements of
+    System.joint_movements() combined with all the delivery level indices of the trucks that go to a tank (the
+    trucks that go to the depot always have delivery index 0, as in System.deterministic_action()).
+
+    Candidates that are not allowed by the graph from the current positions are never chosen (prune_graph), nor
+    the ones in which some truck moves along an edge with a non-finite weight, and with prune_capacity the ones in
+    which some truck brings more than the free capacity of its tank (so that it would not deliver) are discarded
+    too, unless no candidate is left. Stochastic tanks are assumed to consume their mean rate. A ValueError is
+    raised if there are more than max_candidates candidates.
+    """
+    def __init__(self, system, prune_graph = True, prune_capacity = False, max_candidates = 10**6):
+        self.system = system
+        self.n = system.n
+        self.k = system.k
+        self.prune_graph = prune_graph
+        self.prune_capacity = prune_capacity
+
+        n_levels = [len(truck.levels) for truck in system.trucks]
+        n_candidates = (self.n+1)**self.k * int(np.prod(n_levels))
+        if n_candidates > max_candidates:
+            raise ValueError('{} candidate actions exceed max_candidates = {}'.format(n_candidates, max_candidates))
+
+        movements = system.joint_movements()
+        grids = np.meshgrid(*[np.arange(levels) for levels in n_levels], indexing = 'ij')
+        indices = np.stack([grid.ravel() for grid in grids], axis = 1)
+        movement_ids = np.repeat(np.arange(len(movements)), len(indices))
+        indices = np.tile(indices, (len(movements), 1))
+        positions = movements[movement_ids]
+        keep = np.all((positions != self.n) | (indices == 0), axis = 1)
+
+        # Candidate actions [positions, delivery indices], the joint movement of each one and its delivered loads
+        self.movement_ids = movement_ids[keep]
+        self.actions = np.concatenate([positions[keep], indices[keep]], axis = 1)
+        self.positions = self.actions[:, :self.k]
+        at_tank = self.positions != self.n
+        quantities = np.stack([system.trucks[i].levels[self.actions[:, self.k + i]] for i in range(self.k)], axis = 1)
+        self.quantities = np.where(at_tank, quantities, 0.0)
+        self.tanks = np.where(at_tank, self.positions, 0)
+        self.at_tank = at_tank
+
+    def feasible(self, tank_loads, truck_positions):
+        """
+        Returns the boolean mask of the candidates allowed from the given states, tank loads of shape (batch, n) and
+        truck positions (batch, k), according to prune_graph and prune_capacity; shape (batch, candidates).
+        """
+        batch_size = len(tank_loads)
+        mask = np.ones((batch_size, len(self.actions)), dtype = bool)
+        if self.prune_graph:
+            mask &= self.system.joint_action_mask(truck_positions)[:, self.movement_ids]
+        if self.prune_capacity:
+            free = self.system.tanks_max_load_array - tank_loads
+            fits = (self.quantities <= free[:, self.tanks]) | ~self.at_tank
+            pruned = mask & np.all(fits, axis = 2)
+            # keep the unpruned candidates of the states where all of them would be discarded
+            mask = np.where(pruned.any(axis = 1, keepdims = True), pruned, mask)
+        return(mask)
+
+    def scores(self, tank_loads = None, truck_positions = None):
+        """
+        Returns the one-step rewards of every candidate from the given states (by default the current state of
+        the system), with the same value as System.deterministic_action(), shape (batch, candidates), or
+        (candidates,) for the state of the system. The candidates that are not feasible() or that move some truck
+        along an edge with a non-finite weight score -inf. A ValueError is raised if some state has no candidate
+        with a finite score (e.g. trucks at a position without edges in the graph).
+        """
+        single = tank_loads is None
+        if single:
+            tank_loads = self.system.tank_load_array[None, :]
+            truck_positions = self.system.truck_position_array[None, :]
+        tank_loads = np.asarray(tank_loads, dtype = np.float64)
+        truck_positions = np.asarray(truck_positions, dtype = np.int64)
+        batch_size = len(tank_loads)
+        system = self.system
+
+        # Transport weights of every joint movement from the current positions, shared by its delivery levels
+        # (truncated as in System.transport_weights(); the movements along missing edges are discarded below)
+        w = system.weights_array[truck_positions[:, None, :], system.joint_movements()[None, :, :]]
+        finite = np.isfinite(w).all(axis = 2)[:, self.movement_ids]
+        w = np.trunc(np.where(np.isfinite(w), w, 0.0))
+        transport_rewards = config.C_TRANSPORT * system.R_transport(config.COEFF, w[:, self.movement_ids],
+                                                                   self.quantities)
+
+        # Trucks are processed in order, so that several trucks visiting the same tank see its updated load
+        loads = np.repeat(tank_loads[:, None, :], len(self.actions), axis = 1)
+        rows = np.arange(batch_size)[:, None]
+        candidates = np.arange(len(self.actions))
+        trucks_not_deliverying = np.zeros((batch_size, len(self.actions)), dtype = np.int64)
+        for i in range(self.k):
+            tanks = self.tanks[:, i]
+            hipothetic_next_load = loads[rows, candidates, tanks] + self.quantities[:, i]
+            fits = hipothetic_next_load <= system.tanks_max_load_array[tanks]
+            deliver = self.at_tank[:, i] & fits
+            loads[rows, candidates, tanks] = np.where(deliver, hipothetic_next_load, loads[rows, candidates, tanks])
+            trucks_not_deliverying += self.at_tank[:, i] & ~fits
+        np.maximum(0, loads - system.tanks_rate_array, out = loads)
+
+        level_rewards = config.C_LEVELS * rw.R_levels(loads, system.tanks_max_load_array, system.level_breakpoints,
+                                                      config.P1_GLOBAL, config.P2_GLOBAL, config.M_GLOBAL)
+        extra_rewards = config.C_LEVELS * trucks_not_deliverying * config.NOT_DELIVERYING_PENALTY
+        rewards = level_rewards - transport_rewards + extra_rewards
+
+        rewards = np.where(self.feasible(tank_loads, truck_positions) & finite, rewards, -np.inf)
+        if not np.isfinite(rewards).any(axis = 1).all():
+            raise ValueError('no feasible candidate action from some state (check the truck positions and the graph)')
+        return(rewards[0] if single else rewards)
+
+    def plan(self):
+        """
+        Returns the best action from the current state of the system (a list of k positions and k delivery
+        indices, as accepted by System.deterministic_action()) and its one-step reward. Ties are broken by the
+        first candidate.
+        """
+        rewards = self.scores()
+        best = int(np.argmax(rewards))
+        return(self.actions[best].tolist(), float(rewards[best]))
+
+    def step(self):
+        """
+        Takes the best action with system.deterministic_action() and returns its result
+        """
+        action, _ = self.plan()
+        return(self.system.deterministic_action(action))
+
+    def policy(self, batch, rng = None, max_elements = 2**24):
+        """
+        Policy of evaluation.evaluate(): the best actions for all the copies of a BatchSystem, shape
+        (batch_size, 2k). The batch is scored in chunks of at most max_elements tank loads.
+        """
+        chunk = max(1, max_elements // (len(self.actions) * self.n))
+        best = np.empty(batch.batch_size, dtype = np.int64)
+        for start in range(0, batch.batch_size, chunk):
+            stop = min(start + chunk, batch.batch_size)
+            rewards = self.scores(batch.tank_loads[start:stop], batch.truck_positions[start:stop])
+            best[start:stop] = np.argmax(rewards, axis = 1)
+        return(self.actions[best])
@@ -0,0 +1,75 @@
+import csv
+import time
+
+
+class PhaseTimer():
+    """
+    Cumulative wall-clock time and number of calls per phase of a computation (e.g. the movement, delivery,
+    consumption, encoding and reward phases of System.deterministic_action()).
+
+    Typical use inside a function, where every lap() closes the current phase and starts the next one:
+
+        start = timer.start()
+        ... movement ...
+        start = timer.lap('movement', start)
+        ... delivery ...
+        start = timer.lap('delivery', start)
+    """
+    def __init__(self):
+        self.times = {}
+        self.calls = {}
+
+    def start(self):
+        return(time.perf_counter())
+
+    def lap(self, phase, start):
+        """
+        Adds the time elapsed since start to phase and returns the current time (the start of the next phase)
+        """
+        now = time.perf_counter()
+        self.times[phase] = self.times.get(phase, 0.0) + (now - start)
+        self.calls[phase] = self.calls.get(phase, 0) + 1
+        return(now)
+
+    def add(self, phase, seconds, calls = 1):
+        self.times[phase] = self.times.get(phase, 0.0) + seconds
+        self.calls[phase] = self.calls.get(phase, 0) + calls
+
+    def reset(self):
+        self.times = {}
+        self.calls = {}
+
+    def total(self):
+        return(sum(self.times.values()))
+
+    def as_dict(self):
+        """
+        Returns {phase: {'calls': ..., 'total_s': ..., 'mean_s': ..., 'fraction': ...}} in order of first use
+        """
+        total = self.total()
+        stats = {}
+        for phase, seconds in self.times.items():
+            calls = self.calls[phase]
+            stats[phase] = {'calls': calls, 'total_s': seconds, 'mean_s': seconds / calls,
+                            'fraction': seconds / total if total > 0 else 0.0}
+        return(stats)
+
+    def to_csv(self, csv_file, episode = None):
+        """
+        Appends one row per phase (episode, phase, calls, total_s, mean_s, fraction) to csv_file, writing the
+        header if the file is new or empty.
+        """
+        with open(csv_file, 'a', newline = '') as f:
+            writer = csv.writer(f)
+            if f.tell() == 0:
+                writer.writerow(['episode', 'phase', 'calls', 'total_s', 'mean_s', 'fraction'])
+            for phase, stats in self.as_dict().items():
+                writer.writerow([episode, phase, stats['calls'], stats['total_s'], stats['mean_s'],
+                                 stats['fraction']])
+
+    def __repr__(self):
+        lines = ['{:<16} {:>9} {:>12} {:>7}'.format('phase', 'calls', 'total (s)', '%')]
+        for phase, stats in self.as_dict().items():
+            lines.append('{:<16} {:>9} {:>12.6f} {:>6.1f}%'.format(phase, stats['calls'], stats['total_s'],
+                                                                   100 * stats['fraction']))
+        return('\n'.join(lines))
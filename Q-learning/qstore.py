@@ -0,0 +1,283 @@
+"""
+Saving and loading of Q-tables (QTable and ArrayQTable) and training checkpoints.
+
+A Q-table is stored as three arrays sorted by (state, action): the integer states and actions (int64) and the
+Q-values (float32). They are written either to a directory with one .npy file per array (which can be
+memory-mapped, see MappedQTable) or, if the path ends with '.npz', to a single compressed file:
+
+    save_qtable(Q, 'simulations/simulation116/Q')         # memory-mappable directory
+    save_qtable(Q, 'simulations/simulation116/Q.npz')     # compressed
+    Q = load_qtable('simulations/simulation116/Q.npz')
+
+Keys can be the integer codes of System.state_to_int() / action_to_int(), or the fixed-length digit strings of
+System.state_to_string() / action_to_string() (stored as integers and restored with their leading zeros), as
+long as they fit in 64 bits.
+
+During training, Checkpointer saves the Q-table together with the episode and the state of the random
+generators every few episodes, so that an interrupted run can be resumed exactly. Checkpoints keep the Q-values
+in float64 and the order in which the actions of every state were inserted, so that QTable.argmax() breaks ties
+in the same way after resuming:
+
+    checkpointer = Checkpointer(simulation_directory + '/checkpoints', every = 10**3)
+    Q, first_episode = checkpointer.resume(system, default = (QTable(system.state_length), 1))
+    for episode in range(first_episode, n_episodes + 1):
+        ...
+        checkpointer.maybe_save(episode, Q, system)
+"""
+import os
+import json
+import glob
+import pickle
+import shutil
+
+import numpy as np
+
+from qtable import QTable, ArrayQTable
+
+
+KEY_DTYPE = np.int64
+VALUE_DTYPE = np.float32
+CHECKPOINT_VALUE_DTYPE = np.float64
+METADATA_FILE = 'qtable.json'
+STATE_FILE = 'state.pkl'
+_INT64_MAX = np.iinfo(np.int64).max
+
+
+def _key_to_int(key, name):
+    code = int(key)
+    if code < 0 or code > _INT64_MAX:
+        raise ValueError('{} {!r} does not fit in 64 bits; use the integer encodings of System'.format(name, key))
+    return(code)
+
+def qtable_arrays(Q, value_dtype = VALUE_DTYPE):
+    """
+    Returns the arrays (states, actions, values) of a QTable or ArrayQTable, sorted by (state, action), the
+    metadata needed to restore its keys and the position of every entry in the insertion order of the QTable
+    (None for an ArrayQTable).
+    """
+    if isinstance(Q, ArrayQTable):
+        states, actions = np.nonzero(Q.visited)
+        values = Q.values[states, actions]
+        metadata = {'keys': 'int', 'shape': list(Q.values.shape)}
+        return(states.astype(KEY_DTYPE), actions.astype(KEY_DTYPE), values.astype(value_dtype), metadata, None)
+
+    key_type = None
+    lengths = None
+    states = np.empty(len(Q), dtype = KEY_DTYPE)
+    actions = np.empty(len(Q), dtype = KEY_DTYPE)
+    values = np.empty(len(Q), dtype = value_dtype)
+    i = 0
+    for state, row in Q.rows.items():
+        for action, value in row.items():
+            if key_type is None:
+                key_type = 'str' if isinstance(state, str) else 'int'
+                if key_type == 'str':
+                    lengths = [len(state), len(action)]
+            if key_type == 'str' and [len(state), len(action)] != lengths:
+                raise ValueError('string keys must all have the same state and action lengths')
+            states[i] = _key_to_int(state, 'state')
+            actions[i] = _key_to_int(action, 'action')
+            values[i] = value
+            i = i + 1
+
+    order = np.lexsort((actions, states))
+    metadata = {'keys': key_type or 'int', 'lengths': lengths, 'state_length': Q.state_length}
+    return(states[order], actions[order], values[order], metadata, order.astype(KEY_DTYPE))
+
+def save_qtable(Q, path, value_dtype = VALUE_DTYPE, insertion_order = False):
+    """
+    Saves a QTable or ArrayQTable to path: a compressed .npz file if path ends with '.npz', otherwise a
+    directory of memory-mappable .npy files. Returns path. The values are stored as value_dtype (float32 by
+    default); with insertion_order the insertion order of a QTable is stored too (array 'insertion'), and
+    load_qtable() restores it.
+    """
+    states, actions, values, metadata, insertion = qtable_arrays(Q, value_dtype)
+    metadata['size'] = len(values)
+    arrays = {'states': states, 'actions': actions, 'values': values}
+    if insertion_order and insertion is not None:
+        arrays['insertion'] = insertion
+    if path.endswith('.npz'):
+        np.savez_compressed(path, metadata = np.array(json.dumps(metadata)), **arrays)
+        return(path)
+
+    os.makedirs(path, exist_ok = True)
+    for name, array in arrays.items():
+        np.save(os.path.join(path, name + '.npy'), array)
+    with open(os.path.join(path, METADATA_FILE), 'w') as f:
+        json.dump(metadata, f)
+    return(path)
+
+def _read(path, mmap_mode = None):
+    if path.endswith('.npz'):
+        with np.load(path) as data:
+            metadata = json.loads(str(data['metadata']))
+            return(data['states'], data['actions'], data['values'], metadata)
+    with open(os.path.join(path, METADATA_FILE)) as f:
+        metadata = json.load(f)
+    arrays = [np.load(os.path.join(path, name + '.npy'), mmap_mode = mmap_mode)
+              for name in ('states', 'actions', 'values')]
+    return(arrays + [metadata])
+
+def _read_insertion(path):
+    if path.endswith('.npz'):
+        with np.load(path) as data:
+            return(data['insertion'] if 'insertion' in data.files else None)
+    insertion_file = os.path.join(path, 'insertion.npy')
+    return(np.load(insertion_file) if os.path.exists(insertion_file) else None)
+
+def _key_formatter(metadata):
+    if metadata['keys'] == 'str':
+        state_length, action_length = metadata['lengths']
+        return(lambda code: str(code).zfill(state_length), lambda code: str(code).zfill(action_length))
+    return(int, int)
+
+def load_qtable(path, table = None):
+    """
+    Loads a Q-table saved by save_qtable(). By default a QTable (or an ArrayQTable if one was saved) is created;
+    alternatively the values are set into the given table (e.g. ArrayQTable.for_system(system)).
+    The entries are inserted in their original order if it was saved (insertion_order), otherwise in increasing
+    order of their state and action codes.
+    """
+    states, actions, values, metadata = _read(path)
+    if table is None:
+        if 'shape' in metadata:
+            table = ArrayQTable(*metadata['shape'])
+        else:
+            table = QTable(state_length = metadata.get('state_length'))
+
+    if isinstance(table, ArrayQTable):
+        table.values[states, actions] = values
+        table.visited[states, actions] = True
+        return(table)
+
+    insertion = _read_insertion(path)
+    if insertion is not None:
+        order = np.argsort(insertion)
+        states, actions, values = states[order], actions[order], values[order]
+    state_key, action_key = _key_formatter(metadata)
+    for state, action, value in zip(states.tolist(), actions.tolist(), values.tolist()):
+        table.set_q(state_key(state), action_key(action), value)
+    return(table)
+
+
+class MappedQTable():
+    """
+    Read-only Q-table over the memory-mapped arrays of a directory written by save_qtable(), for serving a
+    greedy policy without loading the whole table: every lookup is a binary search over the sorted states.
+    It offers the get_q/max/argmax/epsilon_greedy interface of QTable (keys in the format they were saved with);
+    ties in argmax() are broken by the smallest action code.
+    """
+    def __init__(self, path):
+        self.states, self.actions, self.values, self.metadata = _read(path, mmap_mode = 'r')
+        self._state_key, self._action_key = _key_formatter(self.metadata)
+
+    def _row(self, state):
+        code = int(state)
+        lo = int(np.searchsorted(self.states, code, side = 'left'))
+        hi = int(np.searchsorted(self.states, code, side = 'right'))
+        return(lo, hi)
+
+    def get_q(self, state, action, default = 0.0):
+        lo, hi = self._row(state)
+        i = lo + int(np.searchsorted(self.actions[lo:hi], int(action)))
+        if i < hi and self.actions[i] == int(action):
+            return(float(self.values[i]))
+        return(default)
+
+    def max(self, state, default = 0.0):
+        lo, hi = self._row(state)
+        if lo == hi:
+            return(default)
+        return(float(self.values[lo:hi].max()))
+
+    def argmax(self, state):
+        lo, hi = self._row(state)
+        if lo == hi:
+            return(None)
+        return(self._action_key(int(self.actions[lo + int(np.argmax(self.values[lo:hi]))])))
+
+    def epsilon_greedy(self, state, epsilon, actions = None, rng = None):
+        return(QTable.epsilon_greedy(self, state, epsilon, actions, rng))
+
+    def n_states(self):
+        return(int(np.count_nonzero(np.diff(self.states)) + 1) if len(self.states) else 0)
+
+    def __len__(self):
+        return(len(self.values))
+
+
+def save_checkpoint(path, Q, episode, rng_state = None, **extra):
+    """
+    Saves a training checkpoint to the directory path: the Q-table (as save_qtable(), with float64 values and
+    its insertion order), the episode, the state of the random generators (e.g. system.snapshot_rng()) and any
+    extra picklable values. The checkpoint is written to a temporary directory first, so an interrupted save
+    never leaves a partial checkpoint at path.
+    """
+    tmp = path + '.tmp'
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    save_qtable(Q, os.path.join(tmp, 'Q'), CHECKPOINT_VALUE_DTYPE, insertion_order = True)
+    with open(os.path.join(tmp, STATE_FILE), 'wb') as f:
+        pickle.dump({'episode': episode, 'rng_state': rng_state, 'extra': extra}, f, pickle.HIGHEST_PROTOCOL)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.replace(tmp, path)
+    return(path)
+
+def load_checkpoint(path, table = None):
+    """
+    Returns (Q, episode, rng_state, extra) from a checkpoint saved by save_checkpoint()
+    """
+    with open(os.path.join(path, STATE_FILE), 'rb') as f:
+        state = pickle.load(f)
+    Q = load_qtable(os.path.join(path, 'Q'), table)
+    return(Q, state['episode'], state['rng_state'], state['extra'])
+
+
+class Checkpointer():
+    """
+    Periodic checkpoints of a training run in directory/checkpoint-{episode}, keeping the last keep ones.
+    """
+    def __init__(self, directory, every = 10**3, keep = 2):
+        self.directory = directory
+        self.every = every
+        self.keep = keep
+
+    def path(self, episode):
+        return(os.path.join(self.directory, 'checkpoint-{:09d}'.format(episode)))
+
+    def checkpoints(self):
+        paths = glob.glob(os.path.join(self.directory, 'checkpoint-*[0-9]'))
+        return(sorted(path for path in paths if os.path.exists(os.path.join(path, STATE_FILE))))
+
+    def save(self, episode, Q, system = None, **extra):
+        rng_state = system.snapshot_rng() if system is not None else None
+        path = save_checkpoint(self.path(episode), Q, episode, rng_state, **extra)
+        for old in self.checkpoints()[:-self.keep]:
+            shutil.rmtree(old)
+        return(path)
+
+    def maybe_save(self, episode, Q, system = None, **extra):
+        """
+        Saves a checkpoint if episode is a multiple of self.every. Returns its path, or None.
+        """
+        if episode % self.every == 0:
+            return(self.save(episode, Q, system, **extra))
+        return(None)
+
+    def latest(self):
+        checkpoints = self.checkpoints()
+        return(checkpoints[-1] if checkpoints else None)
+
+    def resume(self, system = None, default = None, table = None):
+        """
+        Loads the latest checkpoint, restores the random generators of system (if given) and returns
+        (Q, next episode). Returns default if there is no checkpoint yet.
+        """
+        path = self.latest()
+        if path is None:
+            return(default)
+        Q, episode, rng_state, extra = load_checkpoint(path, table)
+        if system is not None and rng_state is not None:
+            system.restore_rng(rng_state)
+        return(Q, episode + 1)
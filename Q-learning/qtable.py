@@ -0,0 +1,340 @@
+import numpy as np
+from collections.abc import MutableMapping
+
+
+class QTable(MutableMapping):
+    """
+    Q-table indexed first by the (encoded) state and then by the action.
+
+    Each state owns a small dictionary {action: Q-value}, so getting and setting a Q-value is O(1) and
+    the maximum over the actions of a state only looks at that state's row (and is cached between updates).
+
+    The table also behaves as the plain dictionary used in the Chapter 4 notebooks: with
+    state_length = system.state_length, a key such as system.state_action_to_string() is split into its
+    state and action parts, so Q[sa_str], Q[sa_str] = value, sa_str in Q, Q.keys(), ut.save_obj(Q, ...)
+    keep working. Keys can also be given explicitly as (state, action) tuples.
+    """
+    def __init__(self, state_length = None):
+        self.state_length = state_length
+        self.rows = {}
+        self._best = {} # state -> (best action, best Q-value), dropped when it may be stale
+        self._size = 0
+
+    def _split(self, key):
+        if isinstance(key, tuple) and len(key) == 2:
+            return(key)
+        if isinstance(key, str) and self.state_length is not None:
+            return(key[:self.state_length], key[self.state_length:])
+        raise KeyError(key)
+
+    def _join(self, state, action):
+        if isinstance(state, str) and isinstance(action, str):
+            return(state + action)
+        return((state, action))
+
+    def get_q(self, state, action, default = 0.0):
+        """
+        Returns the Q-value of (state, action), or default if the pair has never been visited.
+        """
+        row = self.rows.get(state)
+        if row is None:
+            return(default)
+        return(row.get(action, default))
+
+    def set_q(self, state, action, value):
+        """
+        Sets the Q-value of (state, action), keeping the cached maximum of the state up to date.
+        """
+        row = self.rows.get(state)
+        if row is None:
+            row = self.rows[state] = {}
+        if action not in row:
+            self._size = self._size + 1
+        row[action] = value
+
+        best = self._best.get(state)
+        if best is None:
+            if len(row) == 1:
+                self._best[state] = (action, value)
+        elif action == best[0]:
+            if value < best[1]:
+                del self._best[state]
+            else:
+                self._best[state] = (action, value)
+        elif value > best[1]:
+            self._best[state] = (action, value)
+        elif value == best[1]:
+            # ties are broken by insertion order, as in the notebooks' optimal_policy()
+            del self._best[state]
+
+    def _best_of(self, state):
+        best = self._best.get(state)
+        if best is None:
+            row = self.rows.get(state)
+            if not row:
+                return(None)
+            action = max(row, key = row.get)
+            best = self._best[state] = (action, row[action])
+        return(best)
+
+    def max(self, state, default = 0.0):
+        """
+        Returns max_a Q(state, a) over the visited actions of the state, or default if the state is unknown.
+        The notebooks' Q_max = max([Q[key] for key ... if key.startswith(state)] + [0.0]) is
+        max(Q.max(state), 0.0).
+        """
+        best = self._best_of(state)
+        if best is None:
+            return(default)
+        return(best[1])
+
+    def argmax(self, state):
+        """
+        Returns the visited action with the highest Q-value for the given state (the first one visited
+        in case of ties), or None if the state has never been visited.
+        """
+        best = self._best_of(state)
+        if best is None:
+            return(None)
+        return(best[0])
+
+    def epsilon_greedy(self, state, epsilon, actions = None, rng = None):
+        """
+        With probability 1-epsilon returns argmax(state). Otherwise (or if the state is unknown) returns a
+        random element of actions, or None when no actions are given so that the caller can fall back to
+        system.random_action().
+        rng can be a numpy.random.Generator or RandomState; by default the global numpy generator is used.
+        """
+        if rng is None:
+            rng = np.random
+        action = None
+        if rng.uniform() > epsilon:
+            action = self.argmax(state)
+        if action is None and actions is not None and len(actions) > 0:
+            action = actions[rng.choice(len(actions))]
+        return(action)
+
+    def state_actions(self, state):
+        """
+        Returns the {action: Q-value} dictionary of the given state (empty if the state is unknown).
+        """
+        return(self.rows.get(state, {}))
+
+    def n_states(self):
+        return(len(self.rows))
+
+    def __getitem__(self, key):
+        state, action = self._split(key)
+        row = self.rows.get(state)
+        if row is None or action not in row:
+            raise KeyError(key)
+        return(row[action])
+
+    def __setitem__(self, key, value):
+        state, action = self._split(key)
+        self.set_q(state, action, value)
+
+    def __delitem__(self, key):
+        state, action = self._split(key)
+        row = self.rows.get(state)
+        if row is None or action not in row:
+            raise KeyError(key)
+        del row[action]
+        self._size = self._size - 1
+        best = self._best.get(state)
+        if best is not None and best[0] == action:
+            del self._best[state]
+        if len(row) == 0:
+            del self.rows[state]
+
+    def __contains__(self, key):
+        try:
+            state, action = self._split(key)
+        except KeyError:
+            return(False)
+        row = self.rows.get(state)
+        return(row is not None and action in row)
+
+    def __iter__(self):
+        for state, row in self.rows.items():
+            for action in row:
+                yield self._join(state, action)
+
+    def __len__(self):
+        return(self._size)
+
+
+class BoundedQTable(QTable):
+    """
+    QTable with a budget of max_entries (state, action) pairs, for state spaces too large to enumerate.
+
+    Every set_q() counts as a visit of the pair. When a new pair would exceed the budget, the evict_fraction
+    of the entries with the lowest score are removed first: with policy = 'visits' the least visited ones (ties
+    broken by the lowest Q-value), with policy = 'value' the ones with the lowest Q-value (ties broken by the
+    fewest visits). After every eviction the visit counters are halved, so that pairs visited long ago can
+    eventually be evicted too. Evicted pairs behave as never visited (get_q() returns the default value).
+
+    Lookups (get_q, max, argmax) count hits and misses, reported by stats() together with the evictions.
+    """
+    def __init__(self, max_entries, state_length = None, evict_fraction = 0.1, policy = 'visits'):
+        if max_entries < 1:
+            raise ValueError('max_entries must be positive')
+        if policy not in ('visits', 'value'):
+            raise ValueError("policy must be 'visits' or 'value'")
+        super().__init__(state_length)
+        self.max_entries = max_entries
+        self.evict_fraction = evict_fraction
+        self.policy = policy
+        self.visits = {} # state -> {action: number of updates}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_q(self, state, action, default = 0.0):
+        row = self.rows.get(state)
+        if row is None or action not in row:
+            self.misses = self.misses + 1
+            return(default)
+        self.hits = self.hits + 1
+        return(row[action])
+
+    def _best_of(self, state):
+        best = super()._best_of(state)
+        if best is None:
+            self.misses = self.misses + 1
+        else:
+            self.hits = self.hits + 1
+        return(best)
+
+    def set_q(self, state, action, value):
+        row = self.rows.get(state)
+        if (row is None or action not in row) and self._size >= self.max_entries:
+            self.evict(max(1, int(self.evict_fraction * self.max_entries)))
+        super().set_q(state, action, value)
+        counts = self.visits.get(state)
+        if counts is None:
+            counts = self.visits[state] = {}
+        counts[action] = counts.get(action, 0) + 1
+
+    def visit_count(self, state, action):
+        return(self.visits.get(state, {}).get(action, 0))
+
+    def evict(self, n_entries):
+        """
+        Removes the n_entries pairs with the lowest score (see the class docstring) and halves the visit
+        counters of the remaining ones. Returns the number of pairs removed.
+        """
+        keys = [(state, action) for state, row in self.rows.items() for action in row]
+        counts = np.array([self.visits[state][action] for state, action in keys], dtype = np.int64)
+        values = np.array([self.rows[state][action] for state, action in keys], dtype = np.float64)
+        if self.policy == 'visits':
+            order = np.lexsort((values, counts))
+        else:
+            order = np.lexsort((counts, values))
+
+        n_entries = min(n_entries, len(keys))
+        for i in order[:n_entries]:
+            del self[keys[i]]
+        self.evictions = self.evictions + n_entries
+
+        for counts in self.visits.values():
+            for action in counts:
+                counts[action] = counts[action] // 2
+        return(n_entries)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        state, action = self._split(key)
+        counts = self.visits[state]
+        del counts[action]
+        if len(counts) == 0:
+            del self.visits[state]
+
+    def stats(self):
+        """
+        Returns a dictionary with the number of entries, the budget, hits, misses, hit rate and evictions
+        """
+        lookups = self.hits + self.misses
+        return({'entries': self._size, 'max_entries': self.max_entries, 'states': len(self.rows),
+                'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions})
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+class ArrayQTable():
+    """
+    Q-table stored as a flat (n_states, n_actions) NumPy array, indexed by the integer codes returned by
+    System.state_to_int() and System.action_to_int(). Only usable when the table fits in memory, see
+    ArrayQTable.for_system().
+
+    It offers the same get_q/set_q/max/argmax/epsilon_greedy interface as QTable; pairs that have never been
+    set are reported as unknown (max() returns the default value and argmax() returns None).
+    """
+    def __init__(self, n_states, n_actions, dtype = np.float64):
+        self.values = np.zeros((n_states, n_actions), dtype = dtype)
+        self.visited = np.zeros((n_states, n_actions), dtype = bool)
+
+    @classmethod
+    def for_system(cls, system, max_entries = 10**8, dtype = np.float64):
+        """
+        Returns an ArrayQTable of shape (system.states_code_dim, system.actions_code_dim).
+        Raises ValueError if it would have more than max_entries entries.
+        """
+        n_entries = system.states_code_dim * system.actions_code_dim
+        if n_entries > max_entries:
+            raise ValueError('Q-table of {} entries exceeds max_entries = {}'.format(n_entries, max_entries))
+        return(cls(system.states_code_dim, system.actions_code_dim, dtype))
+
+    def get_q(self, state, action, default = 0.0):
+        if not self.visited[state, action]:
+            return(default)
+        return(self.values[state, action])
+
+    def set_q(self, state, action, value):
+        self.values[state, action] = value
+        self.visited[state, action] = True
+
+    def max(self, state, default = 0.0):
+        visited = self.visited[state]
+        if not visited.any():
+            return(default)
+        return(self.values[state][visited].max())
+
+    def argmax(self, state, mask = None):
+        """
+        Returns the visited action with the highest Q-value for the given state, or None if the state has
+        never been visited. mask is an optional boolean array over the actions to restrict the search to.
+        """
+        visited = self.visited[state]
+        if mask is not None:
+            visited = visited & mask
+        if not visited.any():
+            return(None)
+        return(int(np.argmax(np.where(visited, self.values[state], -np.inf))))
+
+    def epsilon_greedy(self, state, epsilon, actions = None, rng = None, mask = None):
+        """
+        Same as QTable.epsilon_greedy(); mask optionally restricts the greedy choice to some actions.
+        """
+        if rng is None:
+            rng = np.random
+        action = None
+        if rng.uniform() > epsilon:
+            action = self.argmax(state, mask)
+        if action is None and actions is not None and len(actions) > 0:
+            action = actions[rng.choice(len(actions))]
+        return(action)
+
+    def __getitem__(self, key):
+        return(self.values[key])
+
+    def __setitem__(self, key, value):
+        self.values[key] = value
+        self.visited[key] = True
+
+    def __len__(self):
+        return(int(self.visited.sum()))
@@ -0,0 +1,69 @@
+import numpy as np
+
+
+def level_breakpoints(level_percentages, p0):
+    """
+    Returns the breakpoints a, b, c, d, e, f (as fractions of the tank capacity) of the level reward of each tank,
+    as an array of shape (n, 6), from the (n, 3) array of level percentages [b, c, e] of the tanks.
+    """
+    percentages = np.asarray(level_percentages, dtype = np.float64).reshape(-1, 3)
+    b = percentages[:, 0]
+    c = percentages[:, 1]
+    e = percentages[:, 2]
+
+    a = b/10
+    f = 1-(1-e)/10
+    d = p0*e+(1-p0)*c
+
+    return(np.stack([a, b, c, d, e, f], axis = 1))
+
+def exp_coefficients(a, b, e, f, P1, P2):
+    """
+    Returns the coefficients A, l1, B, l2 of the exponential pieces of R_lvl(): -A*exp(l1/x) between a and b
+    and -B*exp(l2/(1-x)) between e and f.
+    """
+    with np.errstate(divide = 'ignore', over = 'ignore', invalid = 'ignore'):
+        A = -P1*(P2/P1)**(1/(1-b/a))
+        l1 = (1/a-1/b)**(-1) * np.log(P2/P1)
+        B = -P1*(P2/P1)**( 1/(1-(1-e)/(1-f)) )
+        l2 = (1/(1-f)-1/(1-e))**(-1) * np.log(P2/P1)
+    return(A, l1, B, l2)
+
+def level_exp_coefficients(breakpoints, P1, P2):
+    """
+    Returns the (n, 4) array of the coefficients A, l1, B, l2 of every tank, given the (n, 6) breakpoints
+    returned by level_breakpoints().
+    """
+    a, b, c, d, e, f = np.asarray(breakpoints).T
+    return(np.stack(exp_coefficients(a, b, e, f, P1, P2), axis = 1))
+
+def R_lvl(x, C_max, a, b, c, d, e, f, P1, P2, M):
+    """
+    Vectorized version of gym_pdsystem.utils.functions.R_lvl: level reward of tanks with loads x and capacities
+    C_max. All the arguments are broadcast together, so x can have shape (n,) or (batch, n) with per-tank
+    breakpoints of shape (n,).
+    """
+    x = np.asarray(x, dtype = np.float64) / C_max
+
+    A, l1, B, l2 = exp_coefficients(a, b, e, f, P1, P2)
+
+    with np.errstate(divide = 'ignore', over = 'ignore', invalid = 'ignore'):
+        conditions = [x < a, x < b, x < c, x < d, x < e, x < f, x <= 1]
+        functions = [P2,
+                     -A*np.exp(l1/x),
+                     -P1*(x-c)/(c-b),
+                     M*(x-c)/(d-c),
+                     M*(x-e)/(d-e),
+                     -B*np.exp(l2/(1-x)),
+                     P2]
+        R = np.select(conditions, functions, default = P2)
+
+    return(R)
+
+def R_levels(loads, C_max, breakpoints, P1, P2, M):
+    """
+    Returns the total level reward of the tanks (sum over the last axis of loads) given the (n, 6) breakpoints
+    returned by level_breakpoints().
+    """
+    a, b, c, d, e, f = np.asarray(breakpoints).T
+    return(np.sum(R_lvl(loads, C_max, a, b, c, d, e, f, P1, P2, M), axis = -1))
@@ -1,16 +1,117 @@
 import numpy as np
 
+
+def padded_levels(levels_list):
+    """
+    Stacks the (sorted) discrete load levels of several tanks or trucks into an array of shape (n, L),
+    where L is the largest number of levels; shorter rows are padded with np.inf.
+    """
+    n_levels = max(len(levels) for levels in levels_list)
+    table = np.full((len(levels_list), n_levels), np.inf)
+    for i, levels in enumerate(levels_list):
+        table[i, :len(levels)] = levels
+    return(table)
+
+def loads_to_lvls(loads, levels_table):
+    """
+    Batched version of Tank.load_to_lvl(): converts loads of shape (n,) or (batch, n) to discrete levels, where
+    levels_table is the (n, L) array returned by padded_levels().
+
+    The level of a load is the index of the first level >= load, which for sorted levels is the number of levels
+    below the load (as np.searchsorted(levels, load) for each tank). A ValueError is raised if some load is
+    above the maximum level of its tank. To discretize repeatedly with the same table, build a LevelIndex once.
+    """
+    return(LevelIndex(levels_table).lvls(loads))
+
+
+class LevelIndex():
+    """
+    Lookup of the discrete levels of several tanks or trucks (the rows of a padded_levels() table) with
+    np.searchsorted, in O(log(nL)) per load instead of comparing the load with every level of its row.
+
+    The distinct levels of all the rows are sorted in self.values, and the level l of row i is given the integer
+    key i*stride + (position of l in self.values), so that the keys of all the rows form one sorted array. A load
+    of row i is mapped in the same way to i*stride + (number of values below the load), and its level is the
+    number of keys of row i below that key. The comparisons are exact, as with the levels themselves.
+    """
+    def __init__(self, levels_table):
+        table = np.asarray(levels_table, dtype = np.float64)
+        finite = np.isfinite(table)
+        self.values = np.unique(table[finite])
+        self.stride = len(self.values) + 1
+        ranks = np.searchsorted(self.values, table) + self.stride * np.arange(len(table))[:, None]
+        self.keys = ranks[finite]
+        self.n_levels = np.count_nonzero(finite, axis = 1)
+        self.starts = np.cumsum(self.n_levels) - self.n_levels
+
+    def lvls(self, loads, rows = None):
+        """
+        Returns the levels of loads of shape (n,) or (batch, n), or of the given rows only (loads of shape
+        (len(rows),) or (batch, len(rows))). Raises ValueError if some load is above the maximum level of its row.
+        """
+        loads = np.asarray(loads, dtype = np.float64)
+        if rows is None:
+            rows = np.arange(len(self.n_levels))
+        ranks = np.searchsorted(self.values, loads) + self.stride * rows
+        lvls = np.searchsorted(self.keys, ranks) - self.starts[rows]
+        if np.any(lvls == self.n_levels[rows]) or np.isnan(loads).any():
+            raise ValueError('load is above its maximum level')
+        return(lvls)
+
+
 class Tank():
+    """
+    A tank (shop). Its load is stored in self._loads[self._index]: a one-element array of its own until a System
+    binds it to the contiguous array of the loads of all its tanks (see bind()). Once bound, every change of the
+    load adds the index of the tank to the set self._dirty of the System.
+    """
+    __slots__ = ('id', 'max_load', 'levels', 'level_percentages', 'rate', 'stochastic', '_loads', '_index', '_dirty')
+
     def __init__(self, tank_id, current_load, max_load, consumption_rate, n_discrete_load_levels,
                 load_level_percentages, stochastic = False):
         self.id = tank_id
-        self.load = current_load
+        self._loads = np.array([current_load], dtype = np.float64)
+        self._index = 0
+        self._dirty = None
         self.max_load = max_load
         self.levels = np.linspace(0,self.max_load, n_discrete_load_levels+1)[1:]
         self.level_percentages = load_level_percentages
         
         self.rate =  self.max_load * (self.level_percentages[0]+self.level_percentages[1])/2.0 #consumption rate
         self.stochastic = stochastic
+
+    @property
+    def load(self):
+        return(self._loads[self._index])
+
+    @load.setter
+    def load(self, value):
+        self._loads[self._index] = value
+        if self._dirty is not None:
+            self._dirty.add(self._index)
+
+    def bind(self, loads, index, dirty = None):
+        """
+        Makes the load of the tank a view over loads[index] (copying the current load there). If given, index is
+        added to the set dirty whenever the load changes.
+        """
+        loads[index] = self.load
+        self._loads = loads
+        self._index = index
+        self._dirty = dirty
+
+    def __setstate__(self, state):
+        # Tanks pickled before __slots__ (e.g. in the system-sim*.pkl files of the simulations) have a plain
+        # attribute dictionary with 'load'; the current ones have the state (None, {slot: value})
+        if isinstance(state, tuple):
+            state = state[1]
+        state = dict(state)
+        if 'load' in state:
+            state['_loads'] = np.array([state.pop('load')], dtype = np.float64)
+            state['_index'] = 0
+            state['_dirty'] = None
+        for name, value in state.items():
+            setattr(self, name, value)
         
     def fill(self):
         self.load = self.max_load    
@@ -33,9 +134,12 @@ class Tank():
         else:
             return(False)
     
-    def consume(self):
+    def consume(self, rng = None):
+        # rng: numpy.random.Generator of the noise (by default the global NumPy generator)
         if self.stochastic:
-            new_rate = self.rate + self.rate * 0.10 * np.random.uniform(-1,1)
+            if rng is None:
+                rng = np.random
+            new_rate = self.rate + self.rate * 0.10 * rng.uniform(-1,1)
             self.load = max(0, self.load - new_rate)
 
         else:
@@ -46,10 +150,9 @@ class Tank():
         Convert the current load of the tank to the corresponding dicretized level
         """
 
-        levels = self.levels
-        lvl = np.amin(np.where(np.isin(levels,levels[ (levels >= self.load) ])))
-        if lvl < 0:
-            raise ValueError('tank level is negative')
+        lvl = int(np.searchsorted(self.levels, self.load)) # first level >= load
+        if lvl == len(self.levels):
+            raise ValueError('tank load is above its maximum level')
         return(lvl)
       
     def lvl_to_load(self, lvl):
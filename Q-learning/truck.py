@@ -1,14 +1,69 @@
 import numpy as np
 
 class Truck():
+    """
+    A truck. Its load and position are stored in self._loads[self._index] and self._positions[self._index]: arrays
+    of its own until a System binds it to the contiguous arrays of all its trucks (see bind()). Once bound, every
+    change of the load or the position adds the index of the truck to the set self._dirty of the System.
+    """
+    __slots__ = ('id', 'max_load', 'fractions', 'levels', '_loads', '_positions', '_index', '_dirty')
+
     def __init__(self, truck_id, current_load, max_load, current_position, load_fractions_deliverable,
                 n_discrete_load_levels):
         self.id = truck_id
-        self.load = current_load
+        self._loads = np.array([current_load], dtype = np.float64)
+        self._positions = np.array([current_position], dtype = np.int64)
+        self._index = 0
+        self._dirty = None
         self.max_load = max_load
-        self.pos = current_position
         self.fractions = load_fractions_deliverable
         self.levels = np.linspace(0,self.max_load, n_discrete_load_levels+1)[1:]
+
+    @property
+    def load(self):
+        return(self._loads[self._index])
+
+    @load.setter
+    def load(self, value):
+        self._loads[self._index] = value
+        if self._dirty is not None:
+            self._dirty.add(self._index)
+
+    @property
+    def pos(self):
+        return(self._positions[self._index])
+
+    @pos.setter
+    def pos(self, value):
+        self._positions[self._index] = value
+        if self._dirty is not None:
+            self._dirty.add(self._index)
+
+    def bind(self, loads, positions, index, dirty = None):
+        """
+        Makes the load and position of the truck views over loads[index] and positions[index]
+        (copying the current ones there). If given, index is added to the set dirty whenever they change.
+        """
+        loads[index] = self.load
+        positions[index] = self.pos
+        self._loads = loads
+        self._positions = positions
+        self._index = index
+        self._dirty = dirty
+
+    def __setstate__(self, state):
+        # Trucks pickled before __slots__ (e.g. in the system-sim*.pkl files of the simulations) have a plain
+        # attribute dictionary with 'load' and 'pos'; the current ones have the state (None, {slot: value})
+        if isinstance(state, tuple):
+            state = state[1]
+        state = dict(state)
+        if 'load' in state:
+            state['_loads'] = np.array([state.pop('load')], dtype = np.float64)
+            state['_positions'] = np.array([state.pop('pos')], dtype = np.int64)
+            state['_index'] = 0
+            state['_dirty'] = None
+        for name, value in state.items():
+            setattr(self, name, value)
      
     def fill(self):
         self.load = self.max_load
@@ -24,11 +79,9 @@ class Truck():
         """
         Convert the current load of the truck to the corresponding dicretized level
         """
-        levels = self.levels
-        lvl = np.amin(np.where(np.isin(levels,levels[ (levels >= self.load) ])))
-        if lvl < 0:
-            raise ValueError('tank level is negative')
-
+        lvl = int(np.searchsorted(self.levels, self.load)) # first level >= load
+        if lvl == len(self.levels):
+            raise ValueError('truck load is above its maximum level')
         return(lvl)
       
     def lvl_to_load(self, lvl):
@@ -0,0 +1,418 @@
+"""
+Benchmarks of the simulator (System, BatchSystem) and of the learning hot paths (Q-tables, utils_pg helpers).
+
+Every benchmark is run on several scenarios, from the 3-tank setup of the imitation learning chapter up to 30
+tanks and 10 trucks, and reports its throughput (operations per second, see UNITS) and the peak memory
+allocated by its setup and first run (measured with tracemalloc). Results are written as JSON and can be
+compared against a saved baseline:
+
+    python benchmarks/benchmark.py --output baseline.json
+    ... change something ...
+    python benchmarks/benchmark.py --baseline baseline.json --tolerance 0.2
+
+The comparison exits with status 1 if some benchmark is slower than the baseline by more than the tolerance.
+All the scenarios and inputs are generated from --seed, so runs on the same machine are comparable.
+
+The import time of the modules of IMPORTS (in a fresh interpreter, NumPy excluded) is reported too, together with
+the heavy optional modules (matplotlib, gym, ...) they pull in; with --import-budget the script also exits with
+status 1 if some of them takes longer than its budget:
+
+    python benchmarks/benchmark.py --benchmarks deterministic_action --import-budget
+"""
+import os
+import sys
+import json
+import time
+import types
+import contextlib
+import argparse
+import platform
+import subprocess
+import tracemalloc
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'Q-learning'), os.path.join(ROOT, 'Policy-Gradient')]
+
+import model
+import tank
+import truck
+import utils_pg
+import kernels
+import config
+from batch import BatchSystem
+from qtable import QTable, ArrayQTable
+
+
+# name: (number of tanks, number of trucks)
+SCENARIOS = {
+    '3x1': (3, 1),
+    '5x2': (5, 2),
+    '10x3': (10, 3),
+    '30x10': (30, 10),
+}
+
+# Parameters of the thesis test systems, repeated cyclically for larger scenarios
+TANK_MAX_LOADS = [100., 200., 100., 800., 200.]
+LEVEL_PERCENTAGES = [[0.02, 0.31, 0.9],
+                     [0.01, 0.03, 0.9],
+                     [0.05, 0.16, 0.9],
+                     [0.07, 0.14, 0.85],
+                     [0.08, 0.26, 0.9]]
+TRUCK_MAX_LOADS = [70., 130.]
+N_TANK_LEVELS = 4
+
+# Reward constants of the thesis, used when gym_pdsystem is not available
+REWARD_CONSTANTS = {'COEFF': 0.0075*740/1000*1.26, 'C_TRANSPORT': 0.1, 'C_LEVELS': 10.0, 'p0_GLOBAL': 0.7,
+                    'P1_GLOBAL': -10**3, 'P2_GLOBAL': -10**6, 'M_GLOBAL': 10, 'NOT_DELIVERYING_PENALTY': -10**6}
+
+STEPS = 30
+BATCH_SIZE = 256
+EPISODES = 64
+
+UNITS = {
+    'deterministic_action': 'steps/s',
+    'random_action': 'steps/s',
+    'kernel_deterministic_action': 'steps/s',
+    'batch_step': 'steps/s',
+    'batch_step_numpy': 'steps/s',
+    'R_levels': 'calls/s',
+    'load_to_lvl': 'tanks/s',
+    'loads_to_lvls': 'tanks/s',
+    'qtable_update': 'updates/s',
+    'array_qtable_update': 'updates/s',
+    'discount_rewards': 'episodes/s',
+    'int_to_action': 'actions/s',
+}
+
+
+def make_system(n, k, seed = 0, stochastic = False):
+    """
+    Builds a System with n tanks and k trucks (all at the depot and full), with initial tank loads between their
+    first and last level percentages as in initialize_test_system() of the Chapter 4 notebooks.
+    """
+    try:
+        config.load()
+    except ImportError:
+        config.configure(**REWARD_CONSTANTS)
+    rng = np.random.RandomState(seed)
+    tanks = []
+    for i in range(n):
+        max_load = TANK_MAX_LOADS[i % len(TANK_MAX_LOADS)]
+        percentages = np.array(LEVEL_PERCENTAGES[i % len(LEVEL_PERCENTAGES)])
+        a, b = max_load * percentages[0], max_load * percentages[-1]
+        current_load = rng.random_sample() * (b - a - 1) + a + 1
+        tanks.append(tank.Tank(i, current_load, max_load, 0, N_TANK_LEVELS, percentages, stochastic))
+
+    trucks = []
+    for i in range(k):
+        max_load = TRUCK_MAX_LOADS[i % len(TRUCK_MAX_LOADS)]
+        trucks.append(truck.Truck(i, max_load, max_load, n, np.array([1.]), 1))
+
+    graph = np.ones((n+1, n+1), dtype = np.int64)
+    weights = rng.randint(1, 200, size = (n+1, n+1)).astype(np.float64)
+    weights = np.triu(weights, 1) + np.triu(weights, 1).T
+    return model.System(tanks, trucks, graph, weights, seed = seed)
+
+def random_actions(system, n_actions, rng):
+    """
+    Actions for deterministic_action(): random truck positions and the (only) delivery level.
+    """
+    positions = rng.randint(0, system.n + 1, size = (n_actions, system.k))
+    return np.hstack([positions, np.zeros_like(positions)]).tolist()
+
+
+def bench_deterministic_action(n, k, seed):
+    system = make_system(n, k, seed)
+    actions = random_actions(system, STEPS, np.random.RandomState(seed))
+    start = system.snapshot()
+    def run():
+        system.restore(start)
+        for action in actions:
+            system.deterministic_action(action)
+            system.update_state()
+            system.state_to_int()
+    return run, STEPS
+
+def bench_random_action(n, k, seed):
+    system = make_system(n, k, seed)
+    start = system.snapshot()
+    def run():
+        system.restore(start)
+        system.set_seed(seed)
+        for step in range(STEPS):
+            system.random_action()
+            system.update_state()
+            system.state_to_int()
+    return run, STEPS
+
+def bench_kernel_deterministic_action(n, k, seed):
+    system = make_system(n, k, seed)
+    actions = random_actions(system, STEPS, np.random.RandomState(seed))
+    start = system.snapshot()
+    def run():
+        system.restore(start)
+        for action in actions:
+            kernels.deterministic_action(system, action)
+            system.update_state()
+            system.state_to_int()
+    return run, STEPS
+
+def bench_batch_step(n, k, seed, use_kernel = kernels.HAVE_NUMBA):
+    system = make_system(n, k, seed)
+    batch = BatchSystem(system, BATCH_SIZE, seed = seed, use_kernel = use_kernel)
+    actions = np.array(random_actions(system, STEPS * BATCH_SIZE, np.random.RandomState(seed)))
+    actions = actions.reshape(STEPS, BATCH_SIZE, 2*k)
+    start = [array.copy() for array in batch.state()]
+    def run():
+        for array, saved in zip(batch.state(), start):
+            array[:] = saved
+        for action in actions:
+            batch.step(action)
+    return run, STEPS * BATCH_SIZE
+
+def bench_batch_step_numpy(n, k, seed):
+    return bench_batch_step(n, k, seed, use_kernel = False)
+
+def bench_R_levels(n, k, seed):
+    system = make_system(n, k, seed)
+    def run():
+        system.R_levels()
+    return run, 1
+
+def bench_load_to_lvl(n, k, seed):
+    system = make_system(n, k, seed)
+    def run():
+        for current_tank in system.tanks:
+            current_tank.load_to_lvl()
+    return run, n
+
+def bench_loads_to_lvls(n, k, seed):
+    system = make_system(n, k, seed)
+    def run():
+        system.tank_lvls()
+    return run, n
+
+def _transitions(system, n_updates, n_states, seed):
+    rng = np.random.RandomState(seed)
+    states = rng.randint(0, n_states, size = n_updates + 1).tolist()
+    actions = rng.randint(0, min(system.actions_code_dim, 2**62), size = n_updates).tolist()
+    rewards = rng.normal(size = n_updates).tolist()
+    return list(zip(states[:-1], actions, rewards, states[1:]))
+
+def _q_learning_updates(Q, transitions, learning_rate = 0.1, discount_rate = 0.9):
+    for s, a, r, s_next in transitions:
+        q = Q.get_q(s, a)
+        Q.set_q(s, a, q + learning_rate * (r + discount_rate * max(Q.max(s_next), 0.0) - q))
+
+def bench_qtable_update(n, k, seed):
+    system = make_system(n, k, seed)
+    transitions = _transitions(system, 10**4, 10**3, seed)
+    Q = QTable()
+    def run():
+        _q_learning_updates(Q, transitions)
+    return run, len(transitions)
+
+def bench_array_qtable_update(n, k, seed):
+    system = make_system(n, k, seed)
+    try:
+        Q = ArrayQTable.for_system(system, max_entries = 10**7)
+    except ValueError:
+        return None
+    transitions = _transitions(system, 10**4, system.states_code_dim, seed)
+    def run():
+        _q_learning_updates(Q, transitions)
+    return run, len(transitions)
+
+def bench_discount_rewards(n, k, seed):
+    rng = np.random.RandomState(seed)
+    rewards = rng.normal(size = (EPISODES, STEPS))
+    lengths = rng.randint(1, STEPS + 1, size = EPISODES)
+    def run():
+        utils_pg.normalize_rewards(utils_pg.discount_rewards(rewards, 0.9, lengths), lengths)
+    return run, EPISODES
+
+def bench_int_to_action(n, k, seed):
+    env = types.SimpleNamespace(action_space = types.SimpleNamespace(shape = (k, n+1)))
+    codes = np.random.RandomState(seed).randint(0, min((n+1)**k, 2**62), size = 1024)
+    def run():
+        utils_pg.action_to_int(utils_pg.int_to_action(codes, env), env)
+    return run, len(codes)
+
+BENCHMARKS = {name: globals()['bench_' + name] for name in UNITS}
+
+# module: (directory, import time budget in seconds). The simulator core must stay cheap to import, so that
+# spawning many rollout workers is cheap; batch and evaluation also import Numba (kernels.py) when installed.
+IMPORTS = {
+    'model': ('Q-learning', 0.1),
+    'planner': ('Q-learning', 0.1),
+    'batch': ('Q-learning', 1.0),
+    'mlp_classifier': ('Imitation-Learning', 0.05),
+}
+HEAVY_MODULES = ('matplotlib', 'gym', 'gym_pdsystem', 'tensorflow', 'numba')
+
+
+def throughput(run, n_ops, min_time = 0.2, repeat = 3):
+    """
+    Calls run() (which performs n_ops operations) for at least min_time seconds, repeat times, and returns the
+    best number of operations per second.
+    """
+    best = 0.0
+    for r in range(repeat):
+        calls = 0
+        start = time.perf_counter()
+        while True:
+            run()
+            calls = calls + 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_time:
+                break
+        best = max(best, calls * n_ops / elapsed)
+    return best
+
+def run_benchmark(name, scenario, seed = 0, min_time = 0.2, repeat = 3):
+    """
+    Returns the result record of a benchmark on a scenario, or None if it does not apply to it. Anything that
+    the benchmark prints (e.g. the warnings of System for n >= 10) is discarded, so that the JSON written to
+    stdout stays valid.
+    """
+    n, k = SCENARIOS[scenario]
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        tracemalloc.start()
+        try:
+            bench = BENCHMARKS[name](n, k, seed)
+            if bench is not None:
+                bench[0]()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        if bench is None:
+            return None
+
+        run, n_ops = bench
+        value = throughput(run, n_ops, min_time, repeat)
+    return {'name': name, 'scenario': scenario, 'n': n, 'k': k, 'value': value, 'unit': UNITS[name],
+            'peak_kib': peak / 1024.0}
+
+def import_time(module, directory, repeat = 3):
+    """
+    Returns the best cumulative import time (seconds) of module in a fresh interpreter, as reported by
+    python -X importtime (NumPy is imported first and not counted), and the HEAVY_MODULES that it imports.
+    """
+    code = ('import sys, numpy; import {}; '
+            'print(",".join(name for name in {!r} if name in sys.modules))').format(module, HEAVY_MODULES)
+    env = dict(os.environ, PYTHONPATH = os.pathsep.join([os.path.join(ROOT, directory),
+                                                          os.environ.get('PYTHONPATH', '')]))
+    best = None
+    for r in range(repeat):
+        process = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], env = env,
+                                 stdout = subprocess.PIPE, stderr = subprocess.PIPE, universal_newlines = True)
+        if process.returncode != 0:
+            raise RuntimeError('import {} failed:\n{}'.format(module, process.stderr.splitlines()[-1]))
+        for line in process.stderr.splitlines():
+            fields = line.split('|')
+            if len(fields) == 3 and fields[2].strip() == module:
+                seconds = int(fields[1]) / 10**6
+                best = seconds if best is None else min(best, seconds)
+    heavy = [name for name in process.stdout.strip().split(',') if name]
+    return best, heavy
+
+def import_times(modules = None, verbose = True):
+    """
+    Returns the import time records of the given modules of IMPORTS (all by default)
+    """
+    records = []
+    for module in modules or IMPORTS:
+        directory, budget = IMPORTS[module]
+        seconds, heavy = import_time(module, directory)
+        records.append({'module': module, 'seconds': seconds, 'budget_s': budget, 'heavy_modules': heavy})
+        if verbose:
+            print('import {:<22} {:>10.1f} ms (budget {:.0f} ms) {}'.format(
+                module, 1000 * seconds, 1000 * budget, ' '.join(heavy)), file = sys.stderr)
+    return records
+
+def metadata(seed):
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd = ROOT,
+                                         stderr = subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(),
+            'machine': platform.machine(), 'commit': commit, 'seed': seed,
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+def run_all(names = None, scenarios = None, seed = 0, min_time = 0.2, repeat = 3, verbose = True):
+    results = []
+    for scenario in scenarios or SCENARIOS:
+        for name in names or BENCHMARKS:
+            result = run_benchmark(name, scenario, seed, min_time, repeat)
+            if result is None:
+                continue
+            results.append(result)
+            if verbose:
+                print('{:<28} {:<6} {:>14.1f} {:<11} {:>10.1f} KiB'.format(
+                    name, scenario, result['value'], result['unit'], result['peak_kib']), file = sys.stderr)
+    return {'meta': metadata(seed), 'results': results, 'imports': import_times(verbose = verbose)}
+
+def compare(results, baseline, tolerance = 0.2):
+    """
+    Compares the throughput of the benchmarks present in both results and baseline. Returns the list of
+    (name, scenario, ratio) with ratio = value / baseline value, and the ones with ratio < 1 - tolerance.
+    """
+    saved = {(r['name'], r['scenario']): r for r in baseline['results']}
+    ratios = []
+    for result in results['results']:
+        key = (result['name'], result['scenario'])
+        if key in saved and saved[key]['value'] > 0:
+            ratios.append(key + (result['value'] / saved[key]['value'],))
+    regressions = [ratio for ratio in ratios if ratio[2] < 1 - tolerance]
+    return ratios, regressions
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Benchmarks of the simulator and the learning hot paths.')
+    parser.add_argument('--scenarios', nargs = '+', choices = list(SCENARIOS), default = None)
+    parser.add_argument('--benchmarks', nargs = '+', choices = list(BENCHMARKS), default = None)
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--min-time', type = float, default = 0.2, help = 'seconds per repetition')
+    parser.add_argument('--repeat', type = int, default = 3)
+    parser.add_argument('--output', default = None, help = 'JSON file for the results (default: stdout)')
+    parser.add_argument('--baseline', default = None, help = 'JSON file of a previous run to compare with')
+    parser.add_argument('--tolerance', type = float, default = 0.2,
+                        help = 'allowed relative slowdown with respect to the baseline')
+    parser.add_argument('--import-budget', action = 'store_true',
+                        help = 'fail if some module of IMPORTS takes longer to import than its budget')
+    args = parser.parse_args(argv)
+
+    results = run_all(args.benchmarks, args.scenarios, args.seed, args.min_time, args.repeat)
+    if args.output is None:
+        json.dump(results, sys.stdout, indent = 2)
+        print()
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent = 2)
+
+    status = 0
+    if args.import_budget:
+        over = [record for record in results['imports'] if record['seconds'] > record['budget_s']]
+        for record in over:
+            print('import {} takes {:.1f} ms, over its budget of {:.0f} ms'.format(
+                record['module'], 1000 * record['seconds'], 1000 * record['budget_s']), file = sys.stderr)
+        if over:
+            status = 1
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        ratios, regressions = compare(results, baseline, args.tolerance)
+        for name, scenario, ratio in ratios:
+            flag = '  REGRESSION' if (name, scenario, ratio) in regressions else ''
+            print('{:<28} {:<6} {:>6.2f}x{}'.format(name, scenario, ratio, flag), file = sys.stderr)
+        if regressions:
+            status = 1
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
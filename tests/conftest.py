@@ -0,0 +1,55 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for directory in ('Q-learning', 'Policy-Gradient', 'Imitation-Learning'):
+    sys.path.insert(0, os.path.join(ROOT, directory))
+
+import config
+import model
+import tank
+import truck
+
+# Reward constants of the thesis simulations, used when gym_pdsystem is not installed
+REWARD_CONSTANTS = {'COEFF': 0.0075*740/1000*1.26, 'C_TRANSPORT': 0.1, 'C_LEVELS': 10.0, 'p0_GLOBAL': 0.7,
+                    'P1_GLOBAL': -10**3, 'P2_GLOBAL': -10**6, 'M_GLOBAL': 10, 'NOT_DELIVERYING_PENALTY': -10**6}
+
+try:
+    config.load()
+except ImportError:
+    config.configure(**REWARD_CONSTANTS)
+
+SIMULATIONS = os.path.join(ROOT, 'Q-learning', 'simulations')
+
+
+def make_system(n = 5, k = 2, stochastic = False, seed = 0, n_levels = 4, truck_levels = 1):
+    """
+    Returns a random System of n tanks and k trucks on a complete graph with finite weights.
+    """
+    rng = np.random.RandomState(seed)
+    max_loads = rng.choice([100., 200., 800.], n)
+    tanks = [tank.Tank(i, rng.uniform(0.1, 0.9)*max_load, max_load, 0, n_levels, np.array([0.02, 0.31, 0.9]),
+                       stochastic) for i, max_load in enumerate(max_loads)]
+    trucks = [truck.Truck(i, max_load, max_load, n, np.array([1.]), truck_levels)
+              for i, max_load in enumerate(rng.choice([70., 130.], k))]
+    graph = np.ones((n+1, n+1), dtype = int)
+    weights = rng.randint(0, 200, (n+1, n+1)).astype(float)
+    return model.System(tanks, trucks, graph, weights)
+
+
+def load_simulation(name):
+    """
+    Returns the System pickled by the thesis simulation name (e.g. 'simulation216').
+    """
+    import pickle
+    path = os.path.join(SIMULATIONS, name, 'system-sim' + name[len('simulation'):] + '.pkl')
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+@pytest.fixture
+def sim216():
+    return load_simulation('simulation216')
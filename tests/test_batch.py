@@ -0,0 +1,101 @@
+import copy
+
+import numpy as np
+import pytest
+
+import kernels
+from batch import BatchSystem
+from conftest import make_system
+
+
+def random_actions(rng, system, size):
+    positions = rng.integers(system.n + 1, size = (size, system.k))
+    deliveries = rng.integers(len(system.trucks[0].levels), size = (size, system.k))
+    return np.hstack([positions, deliveries])
+
+
+@pytest.mark.parametrize('use_kernel', [False, True])
+@pytest.mark.parametrize('n, k', [(3, 1), (5, 2), (8, 3)])
+def test_batch_matches_system(use_kernel, n, k):
+    base = make_system(n, k, seed = n, truck_levels = 3)
+    batch = BatchSystem(base, 6, use_kernel = use_kernel)
+    systems = [copy.deepcopy(base) for _ in range(batch.batch_size)]
+    rng = np.random.default_rng(0)
+    for t in range(40):
+        actions = random_actions(rng, base, batch.batch_size)
+        rewards = batch.step(actions)
+        for b, system in enumerate(systems):
+            expected = system.deterministic_action(actions[b].tolist())
+            system.update_state()
+            assert tuple(r[b] for r in rewards) == tuple(expected[:4])
+            assert np.array_equal(batch.tank_loads[b], system.tank_load_array)
+            assert np.array_equal(batch.truck_loads[b], system.truck_load_array)
+            assert np.array_equal(batch.truck_positions[b], system.truck_position_array)
+        assert batch.state_codes().tolist() == [system.state_to_int() for system in systems]
+        if t % 10 == 9:
+            batch.reset_trucks_loads()
+            for system in systems:
+                system.reset_trucks_loads()
+
+
+@pytest.mark.parametrize('stochastic', [False, True])
+def test_kernel_matches_numpy_batch(stochastic):
+    base = make_system(6, 2, stochastic, seed = 2, truck_levels = 2)
+    numpy_batch = BatchSystem(base, 32, seed = 3, use_kernel = False)
+    kernel_batch = BatchSystem(base, 32, seed = 3, use_kernel = True)
+    rng = np.random.default_rng(1)
+    for _ in range(30):
+        actions = random_actions(rng, base, 32)
+        for x, y in zip(numpy_batch.step(actions), kernel_batch.step(actions)):
+            assert np.array_equal(x, y)
+        for x, y in zip(numpy_batch.state(), kernel_batch.state()):
+            assert np.array_equal(x, y)
+        assert np.array_equal(numpy_batch.delivery_indices, kernel_batch.delivery_indices)
+        assert np.array_equal(numpy_batch.deliveries, kernel_batch.deliveries)
+
+
+@pytest.mark.parametrize('stochastic', [False, True])
+def test_kernel_matches_system(stochastic):
+    system = make_system(8, 3, stochastic, seed = 2)
+    reference = copy.deepcopy(system)
+    system.set_seed(5)
+    reference.set_seed(5)
+    rng = np.random.default_rng(1)
+    for t in range(50):
+        action = random_actions(rng, system, 1)[0].tolist()
+        assert kernels.deterministic_action(system, action) == reference.deterministic_action(action)
+        system.update_state()
+        reference.update_state()
+        assert system.state() == reference.state()
+        assert system.state_to_int() == reference.state_to_int()
+        if t % 10 == 0:
+            system.reset_trucks_loads()
+            reference.reset_trucks_loads()
+
+
+def test_invalid_delivery_index():
+    system = make_system(5, 2)
+    with pytest.raises(ValueError):
+        kernels.deterministic_action(system, [0, 0, 5, 5])
+
+
+def test_missing_edge_raises(sim216):
+    # In the thesis systems the trucks can only leave the depot: the weights of the other edges are inf
+    sim216.deterministic_action([1, 2, 0, 0])
+    with pytest.raises(OverflowError):
+        sim216.deterministic_action([3, 4, 0, 0])
+    with pytest.raises(OverflowError):
+        kernels.deterministic_action(sim216, [3, 4, 0, 0])
+    for use_kernel in (False, True):
+        batch = BatchSystem(sim216, 3, use_kernel = use_kernel)
+        with pytest.raises(OverflowError):
+            batch.step([3, 4, 0, 0])
+
+
+def test_joint_transport_costs_are_inf_on_missing_edges(sim216):
+    sim216.deterministic_action([1, 2, 0, 0])
+    assert np.isinf(sim216.joint_transport_costs()).any()
+    with pytest.raises(OverflowError):
+        sim216.transport_weights(sim216.joint_movements())
+    sim216.reset_trucks_positions()
+    assert np.isfinite(sim216.joint_transport_costs()).all()
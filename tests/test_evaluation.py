@@ -0,0 +1,95 @@
+import copy
+
+import numpy as np
+import pytest
+
+import evaluation
+from planner import LookaheadPlanner
+from qtable import ArrayQTable, QTable
+from conftest import make_system
+
+
+@pytest.fixture
+def system():
+    return make_system(4, 2, seed = 0, n_levels = 3)
+
+
+@pytest.fixture
+def Q(system):
+    Q = ArrayQTable.for_system(system)
+    rng = np.random.default_rng(1)
+    Q.values[:] = rng.normal(size = Q.values.shape)
+    # Only the actions with valid delivery indices
+    codes = np.arange(system.actions_code_dim)
+    digits = (codes[:, None] // np.array(system.action_strides)) % np.array(system.action_radices)
+    Q.visited[:] = np.all(digits[:, system.k:] < [len(truck.levels) for truck in system.trucks], axis = 1)
+    return Q
+
+
+def scalar_episode(system, Q, loads, episode_length, reset_trucks):
+    system = copy.deepcopy(system)
+    system.tank_load_array[:] = loads
+    system.reset_trucks_positions()
+    system.mark_dirty()
+    system.update_state()
+    totals = np.zeros(len(evaluation.EPISODE_STATISTICS))
+    for _ in range(episode_length):
+        rewards = system.deterministic_action(system.int_to_action(Q.argmax(system.state_to_int())))
+        system.update_state()
+        totals += list(rewards[:4]) + [system.number_of_tanks_empty(),
+                                       sum(p != system.n for p in system.truck_positions())]
+        if reset_trucks:
+            system.reset_trucks_positions()
+            system.reset_trucks_loads()
+            system.update_state()
+    return totals
+
+
+@pytest.mark.parametrize('use_kernel', [False, True])
+@pytest.mark.parametrize('reset_trucks', [True, False])
+def test_evaluate_matches_scalar_loop(system, Q, use_kernel, reset_trucks):
+    loads = evaluation.initial_tank_loads(system, np.random.default_rng(3), 7)
+    result = evaluation.evaluate(system, evaluation.greedy_policy(Q), 7, 20, batch_size = 3, seed = 0,
+                                 initial_loads = loads, reset_trucks = reset_trucks, use_kernel = use_kernel)
+    for episode in range(7):
+        expected = scalar_episode(system, Q, loads[episode], 20, reset_trucks)
+        got = [result['episodes'][name][episode] for name in evaluation.EPISODE_STATISTICS]
+        assert np.allclose(expected, got)
+
+
+def test_table_types_agree(system, Q):
+    Qi = QTable()
+    for state, action in zip(*np.nonzero(Q.visited)):
+        Qi.set_q(int(state), int(action), Q.values[state, action])
+    a = evaluation.evaluate(system, evaluation.greedy_policy(Q), 50, 20, batch_size = 16, seed = 5)
+    b = evaluation.evaluate(system, evaluation.greedy_policy(Qi), 50, 20, batch_size = 16, seed = 5)
+    for name in evaluation.EPISODE_STATISTICS:
+        assert np.array_equal(a['episodes'][name], b['episodes'][name])
+
+
+def test_evaluate_is_reproducible(system):
+    policy = evaluation.movement_policy(lambda loads, rng: rng.integers((system.n+1)**system.k, size = len(loads)))
+    a = evaluation.evaluate(system, policy, 40, 10, batch_size = 16, seed = 2)
+    b = evaluation.evaluate(system, policy, 40, 10, batch_size = 16, seed = 2)
+    for name in evaluation.EPISODE_STATISTICS:
+        assert np.array_equal(a['episodes'][name], b['episodes'][name])
+    c = evaluation.evaluate(system, policy, 40, 10, batch_size = 16, seed = 3)
+    assert not np.array_equal(a['episodes']['rewards'], c['episodes']['rewards'])
+
+
+def test_thesis_system_rewards_are_finite(sim216):
+    # The trucks of the thesis systems can only leave the depot, so they must go back after every step (moving
+    # them along the missing edges used to add inf weights cast to huge integers to the transport rewards)
+    planner = LookaheadPlanner(sim216)
+    result = evaluation.evaluate(sim216, planner.policy, 16, 5, seed = 0)
+    assert np.all(np.abs(result['episodes']['transport_rewards']) < 10**6)
+    assert np.isfinite(result['episodes']['rewards']).all()
+    with pytest.raises(ValueError):
+        evaluation.evaluate(sim216, planner.policy, 16, 5, seed = 0, reset_trucks = False)
+
+
+def test_non_finite_weights_are_rejected(system):
+    system.weights_array[0, 1] = np.inf
+    policy = evaluation.movement_policy(lambda loads, rng: np.zeros(len(loads), dtype = np.int64))
+    with pytest.raises(ValueError):
+        evaluation.evaluate(system, policy, 4, 3, seed = 0)
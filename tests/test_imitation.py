@@ -0,0 +1,83 @@
+import os
+
+import numpy as np
+import pytest
+
+import generate_data as gd
+from dataset import csv_to_columns, ColumnDataset
+from export_classifier import export_classifier
+from mlp_classifier import MLPClassifier
+from conftest import ROOT
+
+IMITATION = os.path.join(ROOT, 'Imitation-Learning')
+TANK_MAX_LOADS = np.array([100., 200., 100.])
+LEVEL_PERCENTAGES = np.array([[0.02, 0.31, 0.9], [0.01, 0.03, 0.9], [0.05, 0.16, 0.9]])
+TRUCK_MAX_LOAD = 50.
+
+
+def test_expert_step_matches_system():
+    states = gd.sample_states(np.random.default_rng(0), 100, TANK_MAX_LOADS)
+    batch = gd.BatchSystem(gd.expert_system(TANK_MAX_LOADS, TRUCK_MAX_LOAD, LEVEL_PERCENTAGES), len(states))
+    batch.tank_loads[:] = states
+    for _ in range(6):
+        gd.expert_step(batch, TRUCK_MAX_LOAD)
+    for j, state in enumerate(states):
+        system = gd.expert_system(TANK_MAX_LOADS, TRUCK_MAX_LOAD, LEVEL_PERCENTAGES)
+        system.tank_load_array[:] = state
+        for _ in range(6):
+            action = gd.leftmost_emptiest_tank_policy(system.tank_load_array[None], TANK_MAX_LOADS, TRUCK_MAX_LOAD)
+            system.deterministic_action([int(action[0]), 0])
+        assert np.allclose(system.tank_load_array, batch.tank_loads[j])
+
+
+def test_check_arguments():
+    gd.check_arguments(TANK_MAX_LOADS, None, 0)
+    gd.check_arguments(TANK_MAX_LOADS, LEVEL_PERCENTAGES, 3)
+    with pytest.raises(ValueError):
+        gd.check_arguments(TANK_MAX_LOADS, None, -1)
+    with pytest.raises(ValueError):
+        gd.check_arguments(TANK_MAX_LOADS, None, 2)
+    with pytest.raises(ValueError):
+        gd.check_arguments(TANK_MAX_LOADS, LEVEL_PERCENTAGES[:2], 2)
+
+
+def test_generate_dataset_does_not_depend_on_the_number_of_workers(tmp_path):
+    contents = []
+    for n_workers in (1, 2):
+        prefix = str(tmp_path / str(n_workers) / 'train')
+        files = gd.generate_dataset(prefix, 250, TANK_MAX_LOADS, TRUCK_MAX_LOAD, seed = 1, shard_size = 100,
+                                    n_workers = n_workers, level_percentages = LEVEL_PERCENTAGES, steps = 2)
+        assert len(files) == 3
+        contents.append([open(f).read() for f in files])
+    assert contents[0] == contents[1]
+
+
+@pytest.mark.parametrize('prefetch', [0, 2])
+def test_column_dataset(tmp_path, prefetch):
+    csv_file = os.path.join(IMITATION, 'data', 'test.txt')
+    expected = np.loadtxt(csv_file, delimiter = ',', skiprows = 1)
+    dataset = ColumnDataset(csv_to_columns(csv_file, str(tmp_path / 'test'), chunk_rows = 300))
+    assert len(dataset) == len(expected) and dataset.features == ['tank1', 'tank2', 'tank3']
+    X, y = dataset.get(slice(None))
+    assert np.array_equal(X, expected[:, :3].astype(np.float32)) and np.array_equal(y, expected[:, 3])
+
+    rows = []
+    for X, y in dataset.batches(128, seed = 0, prefetch = prefetch):
+        assert len(X) == len(y) <= 128
+        rows.append(np.column_stack([X, y]))
+    rows = np.concatenate(rows)
+    assert len(rows) == len(expected)
+    assert np.array_equal(np.unique(rows, axis = 0), np.unique(expected.astype(np.float32), axis = 0))
+    assert sum(1 for _ in dataset.batches(128, shuffle = False, prefetch = prefetch, drop_last = True)) == 7
+
+
+@pytest.mark.parametrize('simulation', [1, 2, 3, 4])
+def test_exported_classifiers(tmp_path, simulation):
+    prefix = os.path.join(IMITATION, 'simulations', 'simulation{}'.format(simulation),
+                          'final_nn_classifier_sim{}.ckpt'.format(simulation))
+    classifier = MLPClassifier.load(export_classifier(prefix, str(tmp_path / 'classifier.npz')))
+    data = np.loadtxt(os.path.join(IMITATION, 'data', 'test.txt'), delimiter = ',', skiprows = 1)
+    X, y = data[:, :3], data[:, 3]
+    predictions = classifier.predict(X)
+    assert np.mean(predictions == y) > 0.98
+    assert [classifier.predict_one(x) for x in X[:50]] == predictions[:50].tolist()
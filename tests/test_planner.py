@@ -0,0 +1,56 @@
+import copy
+
+import numpy as np
+import pytest
+
+from planner import LookaheadPlanner
+from conftest import make_system
+
+
+@pytest.mark.parametrize('n, k', [(3, 1), (4, 2)])
+def test_scores_match_system(n, k):
+    system = make_system(n, k, seed = n, n_levels = 3, truck_levels = 2)
+    graph = np.ones((n+1, n+1), dtype = int)
+    graph[0, 1] = 0
+    system.graph = graph
+    system.feasible_mask = graph == 1
+    planner = LookaheadPlanner(system)
+    system.truck_position_array[0] = 0
+    for _ in range(5):
+        scores = planner.scores()
+        missing = np.any((system.truck_position_array == 0) & (planner.positions == 1), axis = 1)
+        assert np.all(scores[missing] == -np.inf)
+        for action, score in zip(planner.actions, scores):
+            if np.isfinite(score):
+                assert copy.deepcopy(system).deterministic_action(action.tolist())[0] == score
+        action, reward = planner.plan()
+        assert reward == scores.max()
+        system.deterministic_action(action)
+        system.update_state()
+
+
+def test_batch_scores_match_single_scores():
+    system = make_system(4, 2, seed = 1)
+    planner = LookaheadPlanner(system)
+    rng = np.random.default_rng(0)
+    tank_loads = rng.uniform(0, 1, (6, system.n)) * system.tanks_max_load_array
+    truck_positions = rng.integers(system.n + 1, size = (6, system.k))
+    scores = planner.scores(tank_loads, truck_positions)
+    for b in range(6):
+        system.tank_load_array[:] = tank_loads[b]
+        system.truck_position_array[:] = truck_positions[b]
+        assert np.array_equal(planner.scores(), scores[b])
+
+
+def test_missing_edges_are_never_planned(sim216):
+    planner = LookaheadPlanner(sim216)
+    scores = planner.scores()
+    finite = np.isfinite(scores)
+    best = max(copy.deepcopy(sim216).deterministic_action(list(action))[0] for action in planner.actions[finite])
+    assert np.isclose(planner.plan()[1], best)
+
+    # From the tanks every edge of the thesis graphs is missing: there is no candidate left
+    sim216.deterministic_action(planner.plan()[0])
+    for prune_graph in (True, False):
+        with pytest.raises(ValueError):
+            LookaheadPlanner(sim216, prune_graph = prune_graph).plan()
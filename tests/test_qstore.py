@@ -0,0 +1,102 @@
+import os
+import random
+
+import numpy as np
+import pytest
+
+import qstore
+from qtable import QTable, ArrayQTable
+from conftest import make_system
+
+
+@pytest.fixture
+def Q():
+    rng = np.random.RandomState(0)
+    Q = QTable()
+    for _ in range(3000):
+        Q.set_q(int(rng.randint(300)), int(rng.randint(40)), float(rng.normal()))
+    return Q
+
+
+@pytest.mark.parametrize('name', ['Q', 'Q.npz'])
+def test_qtable_round_trip(tmp_path, Q, name):
+    path = str(tmp_path / name)
+    qstore.save_qtable(Q, path)
+    R = qstore.load_qtable(path)
+    assert len(R) == len(Q) and R.n_states() == Q.n_states()
+    for state, row in Q.rows.items():
+        for action, value in row.items():
+            assert R.get_q(state, action) == np.float32(value)
+        assert R.max(state) == np.float32(Q.max(state))
+
+
+def test_mapped_qtable(tmp_path, Q):
+    path = str(tmp_path / 'Q')
+    qstore.save_qtable(Q, path)
+    M = qstore.MappedQTable(path)
+    assert M.n_states() == Q.n_states() and len(M) == len(Q)
+    for state in range(-1, 301):
+        if state not in Q.rows:
+            assert M.max(state, None) is None
+            continue
+        assert M.max(state) == np.float32(Q.max(state))
+        assert M.get_q(state, M.argmax(state)) == M.max(state)
+        assert M.get_q(state, 999) == 0.0
+
+
+def test_string_keys_round_trip(tmp_path):
+    S = QTable(state_length = 4)
+    S['0012' + '05'] = 1.5
+    S['0012' + '13'] = 2.5
+    S['1000' + '00'] = -1.0
+    qstore.save_qtable(S, str(tmp_path / 'S.npz'))
+    assert dict(qstore.load_qtable(str(tmp_path / 'S.npz')).items()) == dict(S.items())
+    qstore.save_qtable(S, str(tmp_path / 'S'))
+    M = qstore.MappedQTable(str(tmp_path / 'S'))
+    assert M.argmax('0012') == '13' and M.max('0012') == 2.5
+
+
+def test_array_qtable_round_trip(tmp_path):
+    A = ArrayQTable(60, 20)
+    A.set_q(3, 4, 1/3)
+    A.set_q(7, 0, -2.)
+    qstore.save_qtable(A, str(tmp_path / 'A.npz'))
+    B = qstore.load_qtable(str(tmp_path / 'A.npz'))
+    assert isinstance(B, ArrayQTable) and len(B) == 2
+    assert B.get_q(3, 4) == np.float32(1/3) and B.get_q(7, 0) == -2.
+
+    qstore.save_checkpoint(str(tmp_path / 'ck'), A, 1)
+    assert qstore.load_checkpoint(str(tmp_path / 'ck'))[0].values[3, 4] == 1/3
+
+
+def test_checkpoint_is_exact(tmp_path, Q):
+    # Ties whose values are not exact in float32 must keep the argmax of the training table
+    for state in range(300, 310):
+        Q.set_q(state, 7, 0.1 + 1e-12)
+        Q.set_q(state, 3, 0.1 + 1e-12)
+        Q.set_q(state, 5, 0.1)
+    path = str(tmp_path / 'ck')
+    qstore.save_checkpoint(path, Q, 5, note = 'test')
+    R, episode, rng_state, extra = qstore.load_checkpoint(path)
+    assert episode == 5 and extra['note'] == 'test'
+    assert list(R.rows) == list(Q.rows)
+    for state, row in Q.rows.items():
+        assert list(R.rows[state].items()) == list(row.items())
+        assert R.argmax(state) == Q.argmax(state)
+    assert R.argmax(300) == 7
+
+
+def test_checkpointer_resume(tmp_path, Q):
+    system = make_system(3, 1)
+    checkpointer = qstore.Checkpointer(str(tmp_path / 'ck'), every = 10, keep = 2)
+    assert checkpointer.resume(system, default = ('none', 1)) == ('none', 1)
+    random.seed(5)
+    np.random.seed(5)
+    for episode in range(1, 36):
+        checkpointer.maybe_save(episode, Q, system)
+        if episode == 30:
+            expected = (random.random(), np.random.random())
+    assert len(os.listdir(str(tmp_path / 'ck'))) == 2
+    R, next_episode = checkpointer.resume(system)
+    assert next_episode == 31 and len(R) == len(Q)
+    assert (random.random(), np.random.random()) == expected
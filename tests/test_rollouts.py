@@ -0,0 +1,76 @@
+import random
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from rollouts import RolloutPool, episode_rng, run_episode
+from utils_pg import int_to_action, action_to_int
+
+N_TANKS = 3
+N_TRUCKS = 2
+MAX_STEPS = 12
+
+
+class ToyEnv():
+    """
+    Small stand-in for PDSystemEnv that draws from the global NumPy and Python generators, as gym does
+    """
+    action_space = SimpleNamespace(shape = (N_TRUCKS, N_TANKS + 1))
+
+    def reset(self):
+        self.loads = np.random.uniform(0.2, 1.0, N_TANKS)
+        return self.loads.copy()
+
+    def step(self, action):
+        for position in action:
+            if position != N_TANKS:
+                self.loads[position] = min(1.0, self.loads[position] + 0.3)
+        self.loads -= np.random.uniform(0.0, 0.2, N_TANKS) + 0.01 * random.random()
+        done = bool(np.any(self.loads <= 0))
+        return self.loads.copy(), -float(np.sum(1.0 - self.loads)), done, {}
+
+
+def make_env():
+    return ToyEnv()
+
+def random_policy(obs, rng):
+    return int(rng.integers((N_TANKS + 1) ** N_TRUCKS))
+
+
+def collect(n_workers, first_episode = 0):
+    with RolloutPool(make_env, random_policy, MAX_STEPS, 10, seed = 7, n_workers = n_workers) as pool:
+        return pool.collect(first_episode)
+
+
+def test_results_do_not_depend_on_the_number_of_workers():
+    results = [collect(n_workers) for n_workers in (1, 3)]
+    for x, y in zip(*results):
+        assert np.array_equal(x, y)
+    rewards, actions, observations, lengths = results[0]
+    assert (lengths > 0).all() and (lengths <= MAX_STEPS).all()
+    for row, length in enumerate(lengths):
+        assert not rewards[row, length:].any() and not observations[row, length:].any()
+
+
+def test_pool_matches_serial_episodes():
+    rewards, actions, observations, lengths = collect(2, first_episode = 5)
+    env = make_env()
+    for row in range(len(lengths)):
+        serial = [np.zeros(MAX_STEPS), np.zeros(MAX_STEPS, dtype = np.int64), np.zeros((MAX_STEPS, N_TANKS))]
+        length = run_episode(env, random_policy, episode_rng(7, 5 + row), *serial)
+        assert length == lengths[row]
+        assert np.array_equal(serial[0], rewards[row]) and np.array_equal(serial[1], actions[row])
+        assert np.array_equal(serial[2], observations[row])
+
+
+def test_int_to_action_round_trip():
+    env = make_env()
+    codes = np.arange((N_TANKS + 1) ** N_TRUCKS)
+    actions = int_to_action(codes, env)
+    assert actions.shape == (len(codes), N_TRUCKS)
+    assert np.array_equal(action_to_int(actions, env), codes)
+    assert int_to_action(np.array([[5]]), env).shape == (N_TRUCKS,)
+    assert list(int_to_action(5, env)) == [1, 1]
+    with pytest.raises(ValueError):
+        action_to_int([1, 2, 3], env)
@@ -0,0 +1,166 @@
+import copy
+import glob
+import os
+import pickle
+
+import numpy as np
+import pytest
+
+import kernels
+import model
+from tank import padded_levels, loads_to_lvls, LevelIndex
+from conftest import make_system, SIMULATIONS
+
+
+def full_digits(system):
+    return (system.truck_positions() + loads_to_lvls(system.truck_load_array, system.trucks_level_table).tolist()
+            + loads_to_lvls(system.tank_load_array, system.tanks_level_table).tolist())
+
+
+@pytest.mark.parametrize('use_kernel', [False, True])
+@pytest.mark.parametrize('stochastic', [False, True])
+def test_incremental_state_matches_full_encode(use_kernel, stochastic):
+    system = make_system(6, 2, stochastic, seed = 5)
+    system.set_seed(2)
+    rng = np.random.default_rng(0)
+    for t in range(200):
+        action = [int(rng.integers(system.n + 1)), int(rng.integers(system.n + 1)), 0, 0]
+        if t % 3 == 0:
+            system.random_action()
+        elif use_kernel:
+            kernels.deterministic_action(system, action)
+        else:
+            system.deterministic_action(action)
+        system.update_state()
+        digits = full_digits(system)
+        assert system.ds_digits.tolist() == digits
+        assert system.state_code == model.mixed_radix_encode(digits, system.state_radices, system.state_strides)
+        assert system.ds == [digits[:2], digits[2:4], digits[4:]]
+        assert system.s == system.state()
+        if t % 10 == 0:
+            system.reset_trucks_positions()
+            system.reset_trucks_loads()
+            system.update_state()
+
+
+def test_mark_dirty_with_arrays():
+    system = make_system(5, 2, seed = 1)
+    system.update_state()
+    system.tank_load_array[[1, 3]] = [1.0, 2.0]
+    system.mark_dirty(tanks = np.array([1, 3]))
+    system.truck_position_array[0] = 2
+    system.mark_dirty(trucks = np.int64(0))
+    system.mark_dirty(tanks = [], trucks = np.array([], dtype = int))
+    system.update_state()
+
+    reference = make_system(5, 2, seed = 1)
+    reference.tank_load_array[[1, 3]] = [1.0, 2.0]
+    reference.truck_position_array[0] = 2
+    reference.mark_dirty()
+    reference.update_state()
+    assert system.state_code == reference.state_code
+    assert np.array_equal(system.ds_digits, reference.ds_digits)
+
+
+def count_levels(loads, table):
+    return np.count_nonzero(np.asarray(loads)[..., None] > table, axis = -1)
+
+
+def test_level_index_matches_count():
+    rng = np.random.default_rng(0)
+    for _ in range(200):
+        n = int(rng.integers(1, 12))
+        levels = [np.sort(rng.choice(np.arange(1, 40) * 2.5, size = int(rng.integers(1, 6)), replace = False))
+                  for _ in range(n)]
+        table = padded_levels(levels)
+        index = LevelIndex(table)
+        top = np.array([l[-1] for l in levels])
+        loads = np.where(rng.random((7, n)) < 0.3, rng.choice(np.concatenate(levels), (7, n)),
+                         rng.random((7, n)) * 100)
+        loads = np.minimum(loads, top)
+        loads[0] = 0.0
+        assert np.array_equal(index.lvls(loads), count_levels(loads, table))
+        rows = rng.choice(n, size = min(n, 3), replace = False)
+        assert np.array_equal(index.lvls(loads[2, rows], rows), count_levels(loads[2, rows], table[rows]))
+
+        above = loads[3].copy()
+        above[0] = top[0] + 1e-9
+        with pytest.raises(ValueError):
+            index.lvls(above)
+        with pytest.raises(ValueError):
+            index.lvls(np.where(np.arange(n) == 0, np.nan, loads[3]))
+
+
+def test_snapshot_restore_replays_random_generators():
+    system = make_system(5, 2, True, seed = 3)
+    system.set_seed(1)
+    system.pregenerate_noise(4)
+    system.deterministic_action([0, 5, 0, 0])
+    system.update_state()
+    snapshot, rng_state = system.snapshot(), system.snapshot_rng()
+    runs = []
+    for _ in range(2):
+        system.restore(snapshot, rng_state)
+        rewards = []
+        for _ in range(8):
+            rewards.append(system.random_action()[0])
+            system.update_state()
+            system.reset_trucks_positions()
+            system.update_state()
+        runs.append((rewards, system.tank_load_array.copy(), system.state_code))
+    assert runs[0][0] == runs[1][0]
+    assert np.array_equal(runs[0][1], runs[1][1]) and runs[0][2] == runs[1][2]
+
+
+def test_seeded_system_is_reproducible():
+    episodes = []
+    for seed in (11, 11, 12):
+        system = make_system(8, 3, True)
+        system.set_seed(seed)
+        episode = []
+        for t in range(20):
+            episode.append((system.random_action(), system.state()))
+            system.update_state()
+            if t % 5 == 0:
+                system.reset_trucks_positions()
+        episodes.append(episode)
+    assert episodes[0] == episodes[1]
+    assert episodes[0] != episodes[2]
+
+
+def test_random_action_seed_keeps_noise_stream():
+    system = make_system(5, 2, True, seed = 3)
+    system.pregenerate_noise(10)
+    table, state = system.noise_table.copy(), system.noise_rng.bit_generator.state
+    system.random_action(seed = 7)
+    assert np.array_equal(system.noise_table, table)
+    assert system.noise_rng.bit_generator.state == state
+
+
+def test_pickle_round_trip():
+    a = make_system(5, 2, True, seed = 3)
+    a.set_seed(4)
+    a.pregenerate_noise(5)
+    b = pickle.loads(pickle.dumps(a))
+    assert b.tanks[2]._loads is b.tank_load_array
+    for system in (a, b):
+        system.deterministic_action([1, 5, 0, 0])
+        system.update_state()
+    assert np.array_equal(a.tank_load_array, b.tank_load_array)
+    assert a.state_code == b.state_code
+
+
+@pytest.mark.parametrize('path', sorted(glob.glob(os.path.join(SIMULATIONS, '*', 'system-sim*.pkl'))),
+                         ids = os.path.basename)
+def test_legacy_pickles_load(path):
+    with open(path, 'rb') as f:
+        system = pickle.load(f)
+    assert system.tanks[0]._loads is system.tank_load_array
+    assert system.trucks[-1]._positions is system.truck_position_array
+    reference = copy.deepcopy(system)
+    reference.mark_dirty()
+    reference.update_state()
+    assert system.state_code == reference.state_code
+    system.deterministic_action([0] * system.k + [0] * system.k)
+    system.update_state()
+    assert system.ds_digits.tolist() == full_digits(system)